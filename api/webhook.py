@@ -1,69 +1,324 @@
 # api/webhook
+# Холодный старт: на уровне модуля только FastAPI и лёгкие утилиты.
+# python-telegram-bot, хендлеры и Redis импортируются/подключаются при первом использовании.
 import os
 import asyncio
-from fastapi import FastAPI, Request, HTTPException
-from telegram import Update
-from telegram.ext import Application, MessageHandler, CommandHandler, ChatMemberHandler, filters
-import orjson
-from authorization.subscription import welcome_new_user, start_command, handle_buttons
-from authorization.webhook import webhook_update
-from authorization.support import handle_support_text
-from utils.logger import logger
-from config import TELEGRAM_TOKEN, SUPPORT_CHAT_ID
-
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
-
-async def build_application():
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    await application.initialize()
+import importlib
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+from utils.startup import startup_phase, log_startup_report
+
+with startup_phase("import web stack"):
+    from fastapi import FastAPI, Request, HTTPException
+    from fastapi.responses import JSONResponse, Response
+    import orjson
+
+from utils.logger import logger, should_log_update
+from utils.metrics import registry, handler_duration, update_duration, updates_routed
+from utils.redis_client import redis_client, close_redis
+from utils.update_queue import UpdateQueue, UpdateDeduplicator, extract_user_id
+from utils.update_stream import publish_update, worker_health, worker_metrics
+from authorization.expiry import ExpiryScheduler, activity_tracker
+from utils.user_cache import user_cache
+from utils.settings_store import settings_store, close_mongo
+from config import (
+    TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL, SUPPORT_CHAT_ID, BOT_CONNECTION_POOL_SIZE,
+    ACCEPT_FAST, REPLY_IN_RESPONSE, FAST_PATH_ROUTING, UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_DEDUP_TTL,
+    WORKER_MODE, WORKER_PROCESSES, UPDATE_SHARDS, UPDATE_STREAM_MAXLEN,
+)
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
+
+# Один "тёплый" Application на процесс: HTTP-клиент бота и его пул соединений
+# переиспользуются между апдейтами, getMe вызывается только один раз.
+_application: "Application | None" = None
+_application_lock = asyncio.Lock()
+
+_callbacks: dict = {}
+
+def lazy_callback(path: str):
+    """
+    Хендлер в виде "модуль:функция": модуль импортируется при первом апдейте, который до него дошёл.
+    Одна обёртка на путь — её используют и хендлеры PTB, и быстрый маршрут.
+    """
+    if path in _callbacks:
+        return _callbacks[path]
+    module_name, _, attr = path.partition(":")
+    callback = None
+
+    async def run(update, context):
+        nonlocal callback
+        if callback is None:
+            with startup_phase(f"import {module_name}"):
+                callback = getattr(importlib.import_module(module_name), attr)
+        with handler_duration.time(attr):
+            return await callback(update, context)
+
+    _callbacks[path] = run
+    return run
+
+# Быстрый маршрут по сырому JSON: DROP — ни один хендлер ничего не сделает,
+# DISPATCH — случай неоднозначный, отдаём полной диспетчеризации PTB,
+# иначе — путь единственного хендлера, которому нужен апдейт.
+DROP = "drop"
+DISPATCH = "dispatch"
+
+def _is_command(message: dict) -> bool:
+    # Как filters.COMMAND: первая entity — bot_command в начале текста
+    entities = message.get("entities")
+    return bool(entities) and entities[0].get("type") == "bot_command" and entities[0].get("offset") == 0
+
+def route_update(update_json: dict) -> str:
+    """
+    Повторяет фильтры из build_application, но по ключам сырого JSON — без Update.de_json.
+    """
+    my_chat_member = update_json.get("my_chat_member")
+    if my_chat_member is not None:
+        # welcome_new_user реагирует только на личный чат и статус member
+        if (my_chat_member.get("chat", {}).get("type") == "private"
+                and my_chat_member.get("new_chat_member", {}).get("status") == "member"):
+            return "authorization.subscription:welcome_new_user"
+        return DROP
+
+    # MessageHandler/CommandHandler PTB обрабатывают и отредактированные сообщения
+    message = update_json.get("message") or update_json.get("edited_message")
+    if message is None:
+        return DROP  # callback_query, channel_post, chat_member и т.п. — хендлеров нет
+
+    if "web_app_data" in message:
+        return "authorization.webhook:webhook_update" if "message" in update_json else DROP
+
+    text = message.get("text")
+    if text is None:
+        return DROP
+    if _is_command(message):
+        # Как CommandHandler: команда — первая entity, без учёта регистра
+        command = text[1:message["entities"][0]["length"]].lower()
+        if command == "start":
+            return "authorization.subscription:start_command"
+        # /start@username сверяется с именем бота — это умеет только CommandHandler
+        return DISPATCH if command.startswith("start@") else DROP
+
+    if message.get("chat", {}).get("id") == SUPPORT_CHAT_ID:
+        # handle_support_text отвечает только на reply к сообщению поддержки
+        return "authorization.support:handle_support_text" if message.get("reply_to_message") else DROP
+    return DROP  # Текстовые кнопки: handle_buttons ничего не делает
+
+async def build_application() -> "Application":
+    with startup_phase("import telegram"):
+        from telegram.ext import Application, MessageHandler, CommandHandler, ChatMemberHandler, filters
+
+    with startup_phase("initialize bot (getMe)"):
+        from utils.telegram_utils import InstrumentedHTTPXRequest
+
+        application = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .base_url(TELEGRAM_API_BASE_URL)
+            .request(InstrumentedHTTPXRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE))
+            .updater(None)  # webhook обслуживает FastAPI, Updater не нужен
+            .build()
+        )
+        await application.initialize()
 
     # Хендлер поддержки
     application.add_handler(MessageHandler(
         filters.Chat(SUPPORT_CHAT_ID) & filters.TEXT & ~filters.COMMAND,
-        handle_support_text
+        lazy_callback("authorization.support:handle_support_text")
     ))
 
     # WebApp данные
-    application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, webhook_update))
+    application.add_handler(MessageHandler(
+        filters.StatusUpdate.WEB_APP_DATA, lazy_callback("authorization.webhook:webhook_update")
+    ))
 
     # Новый пользователь
-    application.add_handler(ChatMemberHandler(welcome_new_user, ChatMemberHandler.MY_CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(
+        lazy_callback("authorization.subscription:welcome_new_user"), ChatMemberHandler.MY_CHAT_MEMBER
+    ))
 
     # /start
-    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("start", lazy_callback("authorization.subscription:start_command")))
 
     # Текстовые кнопки
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buttons))
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND, lazy_callback("authorization.subscription:handle_buttons")
+    ))
 
     return application
 
+async def get_application() -> "Application":
+    """
+    Возвращает общий Application, создавая его при первом обращении.
+    Serverless холодный старт без lifespan инициализируется здесь же, лениво.
+    """
+    global _application
+    if _application is None:
+        async with _application_lock:
+            if _application is None:
+                _application = await build_application()
+                logger.info("🚀 Telegram application initialized")
+    return _application
+
+async def shutdown_application():
+    global _application
+    async with _application_lock:
+        if _application is not None:
+            await _application.shutdown()
+            _application = None
+            logger.info("🛑 Telegram application shut down")
+
+async def process_update_json(update_json: dict):
+    from telegram import Update
+
+    route = route_update(update_json) if FAST_PATH_ROUTING else DISPATCH
+    updates_routed.inc(route if route in (DROP, DISPATCH) else "direct")
+    if route == DROP:
+        return
+
+    user_id = extract_user_id(update_json)
+    if user_id:
+        activity_tracker.touch(user_id)
+        await activity_tracker.maybe_flush()
+
+    application = await get_application()
+    with update_duration.time("accept-fast" if ACCEPT_FAST else "inline"):
+        update = Update.de_json(update_json, application.bot)
+        if route == DISPATCH:
+            await application.process_update(update)
+        else:
+            # Сразу в нужный хендлер, минуя перебор всех хендлеров PTB
+            context = application.context_types.context.from_update(update, application)
+            try:
+                await lazy_callback(route)(update, context)
+            except Exception as e:
+                # Как Application.process_update: ошибка хендлера уходит в process_error, а не в 500,
+                # иначе Telegram доставит апдейт повторно
+                await application.process_error(update=update, error=e)
+
+async def process_with_webhook_reply(update_json: dict) -> Response | dict:
+    """Обрабатывает апдейт и, если хендлер отложил единственный вызов, возвращает его в теле ответа"""
+    from utils.telegram_utils import WebhookReply, webhook_reply
+
+    reply = WebhookReply()
+    token = webhook_reply.set(reply)
+    try:
+        await process_update_json(update_json)
+    finally:
+        webhook_reply.reset(token)
+    if reply.payload is None:
+        return {"ok": True}
+    return Response(content=orjson.dumps(reply.payload), media_type="application/json")
+
+# Accept-fast режим: отвечаем 200 сразу, апдейт обрабатывают фоновые воркеры
+update_queue = UpdateQueue(process_update_json, workers=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE)
+update_deduplicator = UpdateDeduplicator(redis_client, ttl=UPDATE_DEDUP_TTL)
+expiry_scheduler: ExpiryScheduler | None = None
+
+async def enqueue_update(update_json: dict) -> JSONResponse | dict:
+    update_id = update_json.get("update_id")
+    if update_id is not None and not await update_deduplicator.is_new(update_id):
+        logger.debug("🔁 Duplicate update_id=%s, skipping", update_id)
+        return {"ok": True}
+
+    update_queue.start()  # Serverless без lifespan: очередь запускается при первом апдейте
+    if not await update_queue.put(update_json):
+        # Telegram доставит апдейт повторно — он не должен отброситься как дубликат
+        if update_id is not None:
+            await update_deduplicator.forget(update_id)
+        return JSONResponse({"ok": False}, status_code=503)
+    return {"ok": True}
+
+async def publish_to_workers(update_json: dict, body: bytes) -> JSONResponse | dict:
+    """Режим воркеров: апдейт уходит в stream своего шарда, обработают процессы api.worker"""
+    from redis.exceptions import RedisError
+
+    update_id = update_json.get("update_id")
+    if update_id is not None and not await update_deduplicator.is_new(update_id):
+        logger.debug("🔁 Duplicate update_id=%s, skipping", update_id)
+        return {"ok": True}
+    try:
+        await publish_update(redis_client, update_json, body, UPDATE_SHARDS, maxlen=UPDATE_STREAM_MAXLEN)
+    except RedisError as e:
+        logger.error("❌ Failed to publish update_id=%s: %r", update_id, e)
+        if update_id is not None:
+            await update_deduplicator.forget(update_id)
+        return JSONResponse({"ok": False}, status_code=503)
+    return {"ok": True}
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global expiry_scheduler
+    await get_application()
+    await user_cache.start_invalidation_listener()
+    # Восстановление из MongoDB идёт в фоновой задаче хранилища: старт его не ждёт
+    settings_store.start()
+    if ACCEPT_FAST:
+        update_queue.start()
+    # Долгоживущий процесс сам разбирает истёкшие подписки; инстансы не мешают друг другу
+    expiry_scheduler = ExpiryScheduler(redis_client)
+    expiry_scheduler.start()
+    try:
+        yield
+    finally:
+        await expiry_scheduler.stop()
+        await update_queue.stop()
+        await activity_tracker.flush()
+        await settings_store.stop()
+        await close_mongo()
+        await user_cache.stop_invalidation_listener()
+        await shutdown_application()
+        await close_redis()
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None, lifespan=lifespan)
+
+@app.get("/metrics")
+async def metrics():
+    # В режиме воркеров обработка идёт в api.worker: их счётчики суммируются с метриками фронта
+    snapshots = await worker_metrics(redis_client) if WORKER_MODE else ()
+    return Response(content=registry.render(snapshots), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/workers")
+async def workers_health():
+    """Heartbeat-ы процессов-обработчиков; 503, если работающих меньше ожидаемого"""
+    workers = await worker_health(redis_client)
+    running = sum(1 for worker in workers if worker.get("state") == "running")
+    expected = WORKER_PROCESSES if WORKER_MODE else 0
+    return JSONResponse(
+        {"expected": expected, "running": running, "workers": workers},
+        status_code=200 if running >= expected else 503,
+    )
+
 @app.post("/telegram-webhook")
 async def telegram_webhook(request: Request):
     try:
         body = await request.body()
         update_json = orjson.loads(body)
+        if FAST_PATH_ROUTING and route_update(update_json) == DROP:
+            updates_routed.inc(DROP)
+            return {"ok": True}
 
-        application = await build_application()
-        update = Update.de_json(update_json, application.bot)
-
-        logger.info(f"📩 Incoming update: {orjson.dumps(update_json).decode('utf-8')}")
-        await application.process_update(update)
-
-        # Shutdown без задержки, Serverless
-        async def shutdown_later(app, delay: float = 0.0):
-            if delay > 0:
-                await asyncio.sleep(delay)
-            await app.shutdown()
+        if should_log_update():
+            logger.info("📩 Incoming update: %s", body.decode("utf-8"), extra={"update_id": update_json.get("update_id")})
+        if WORKER_MODE:
+            return await publish_to_workers(update_json, body)
+        if ACCEPT_FAST:
+            return await enqueue_update(update_json)
+        if REPLY_IN_RESPONSE:
+            response = await process_with_webhook_reply(update_json)
+            log_startup_report()
+            return response
 
-        is_new_user = getattr(update, "my_chat_member", None) and update.my_chat_member.new_chat_member.status in ["member", "administrator"]
-        asyncio.create_task(shutdown_later(application, delay=1.5 if is_new_user else 1.5))
+        await process_update_json(update_json)
+        log_startup_report()
 
         return {"ok": True}
 
     except Exception as e:
-        logger.exception(f"Telegram webhook error: {e}")
+        logger.exception("Telegram webhook error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 3001)))
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 3001)))
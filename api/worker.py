@@ -0,0 +1,53 @@
+# api/worker.py
+"""
+Процесс-обработчик апдейтов для долгоживущего режима (см. serve.py).
+Читает свои шарды updates:* из Redis streams и обрабатывает их тем же кодом, что и webhook:
+
+    python -m api.worker --index 0 --count 4
+"""
+import argparse
+import asyncio
+import signal
+from config import UPDATE_SHARDS, WORKER_DRAIN_TIMEOUT
+from utils.logger import logger
+from utils.update_stream import UpdateStreamWorker, owned_shards
+
+async def run_worker(index: int, count: int):
+    from api.webhook import get_application, shutdown_application, process_update_json
+    from authorization.expiry import activity_tracker
+    from utils.redis_client import redis_client, close_redis
+    from utils.settings_store import settings_store, close_mongo
+    from utils.user_cache import user_cache
+
+    await get_application()
+    worker = UpdateStreamWorker(
+        redis_client, process_update_json, owned_shards(index, count, UPDATE_SHARDS), consumer=f"worker-{index}",
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await worker.start()
+    await user_cache.start_invalidation_listener()
+    try:
+        await stop.wait()
+        logger.info("⏳ Update worker %s draining", worker.consumer)
+    finally:
+        await worker.stop(drain_timeout=WORKER_DRAIN_TIMEOUT)
+        await activity_tracker.flush()
+        await settings_store.stop()
+        await close_mongo()
+        await user_cache.stop_invalidation_listener()
+        await shutdown_application()
+        await close_redis()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", type=int, required=True, help="номер воркера, 0..count-1")
+    parser.add_argument("--count", type=int, required=True, help="всего воркеров")
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.index, args.count))
+
+if __name__ == "__main__":
+    main()
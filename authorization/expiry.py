@@ -0,0 +1,239 @@
+# authorization/expiry.py
+import asyncio
+import sys
+import time
+from datetime import datetime, timezone
+from config import ACTIVITY_FLUSH_INTERVAL, EXPIRY_INTERVAL, NOTIFICATION_DISPATCHER
+from utils.logger import logger
+from utils.redis_client import redis_client
+
+# Sorted sets: score — unix-время окончания подписки / последней активности.
+# Не в пространстве zemo:{user_id}: там только хеши профилей.
+SUBSCRIPTIONS_KEY = "zemo-sched:subscriptions"
+ACTIVITY_KEY = "zemo-sched:activity"
+
+SUBSCRIPTION_DAYS = 7
+TRIAL_DAYS = 2
+INACTIVITY_TTL = int(1.2 * 30 * 24 * 60 * 60)  # 1.2 месяца
+
+# Атомарно забирает до ARGV[2] участников со score <= ARGV[1]: ZRANGEBYSCORE + ZREM за O(log n + m).
+# Несколько инстансов могут крутить воркер одновременно — каждый получит свою часть.
+# Возвращает пары (участник, score), чтобы при сбое обработки вернуть пачку на место.
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+end
+return due
+"""
+
+# Выключает мониторинг только у существующих профилей и возвращает их языки (nil — профиля нет).
+# HSET на отсутствующий ключ создал бы заглушку, и профиль больше не восстановился бы из MongoDB.
+EXPIRE_PROFILES_SCRIPT = """
+local languages = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HSET', key, 'monitoring', '0')
+        languages[i] = redis.call('HGET', key, 'language')
+    else
+        languages[i] = false
+    end
+end
+return languages
+"""
+
+async def extend_subscription(user_id: int, days: int = SUBSCRIPTION_DAYS) -> datetime:
+    """
+    Продлевает подписку от большей из дат: сейчас или текущее окончание.
+    Возвращает новую дату окончания (для сообщения payment).
+    Точка входа для обработчиков пробного периода (TRIAL_DAYS) и оплаты — только через неё
+    подписка попадает в расписание истечения.
+    """
+    now = time.time()
+    current = await redis_client.zscore(SUBSCRIPTIONS_KEY, user_id)
+    expires_at = max(now, current or 0) + days * 24 * 60 * 60
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zadd(SUBSCRIPTIONS_KEY, {user_id: expires_at})
+        pipe.hset(f"zemo:{user_id}", mapping={"subscription_until": int(expires_at), "monitoring": "1"})
+        await pipe.execute()
+    return datetime.fromtimestamp(expires_at, tz=timezone.utc)
+
+def _forget_matches(user_ids):
+    """Убирает пользователей из индекса сопоставления, если он построен в этом процессе"""
+    # Индекс есть только там, где matcher уже импортирован — ради удаления NumPy не тянем
+    matcher = sys.modules.get("monitoring.matcher")
+    if matcher is not None and matcher.subscription_index.loaded:
+        for user_id in user_ids:
+            matcher.subscription_index.remove(user_id)
+
+
+class ActivityTracker:
+    """
+    Копит касания активности в памяти и пишет их одним ZADD раз в flush_interval,
+    вместо отдельного EXPIRE на каждое взаимодействие.
+    """
+    def __init__(self, redis, flush_interval=10.0):
+        self.redis = redis
+        self.flush_interval = flush_interval
+        self.pending: dict[int, float] = {}
+        self.last_flush = time.monotonic()
+
+    def touch(self, user_id: int):
+        self.pending[user_id] = time.time()
+
+    async def maybe_flush(self):
+        """Сбрасывает накопленное, если прошёл интервал — работает и без фоновой задачи (serverless)"""
+        if self.pending and time.monotonic() - self.last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        from redis.exceptions import RedisError
+
+        pending, self.pending = self.pending, {}
+        self.last_flush = time.monotonic()
+        try:
+            # GT: не откатываем время активности, если другой инстанс уже записал более позднее
+            await self.redis.zadd(ACTIVITY_KEY, pending, gt=True)
+        except RedisError as e:
+            # Учёт активности не должен ронять апдейт: пачка вернётся в следующий сброс
+            for user_id, touched_at in pending.items():
+                self.pending[user_id] = max(touched_at, self.pending.get(user_id, 0))
+            logger.warning("⚠️ Failed to flush activity of %s users: %r", len(pending), e)
+
+
+class ExpiryScheduler:
+    """
+    Периодический воркер: забирает только наступившие записи из sorted sets пачками,
+    применяет изменения состояния одним pipeline и рассылает уведомления пачкой через dispatcher.
+    """
+    def __init__(self, redis, interval=EXPIRY_INTERVAL, batch_size=500, inactivity_ttl=INACTIVITY_TTL,
+                 send_concurrency=16):
+        self.redis = redis
+        self.interval = interval
+        self.batch_size = batch_size
+        self.inactivity_ttl = inactivity_ttl
+        self.send_concurrency = send_concurrency
+        self.pop_due = redis.register_script(POP_DUE_SCRIPT)
+        self.expire_profiles = redis.register_script(EXPIRE_PROFILES_SCRIPT)
+        self.task: asyncio.Task | None = None
+
+    async def _pop(self, key: str, deadline: float) -> dict[int, float]:
+        due = await self.pop_due(keys=[key], args=[deadline, self.batch_size])
+        return {int(user_id): float(score) for user_id, score in zip(due[::2], due[1::2])}
+
+    async def _restore(self, key: str, due: dict[int, float]):
+        """Возвращает забранную пачку, если её не удалось обработать: следующий проход повторит"""
+        try:
+            await self.redis.zadd(key, due, nx=True)
+        except Exception as e:
+            logger.error("❌ Failed to return %s entries to %s: %r", len(due), key, e)
+
+    async def _send_directly(self, jobs: list[tuple[int, dict]]):
+        """Без dispatcher очередь никто не разбирает — шлём сами, через общий лимитер и повторы"""
+        from api.webhook import get_application
+        from utils.telegram_utils import retry_on_timeout
+
+        bot = (await get_application()).bot
+        semaphore = asyncio.Semaphore(self.send_concurrency)
+
+        async def notify(chat_id: int, payload: dict):
+            async def send():
+                return await bot.send_message(chat_id=chat_id, **payload)
+            async with semaphore:
+                try:
+                    await retry_on_timeout(send, chat_id=chat_id, message_text=payload["text"])
+                except Exception as e:
+                    logger.warning("⚠️ Failed to notify chat_id=%s about expiry: %r", chat_id, e)
+
+        await asyncio.gather(*(notify(chat_id, payload) for chat_id, payload in jobs))
+
+    async def _notify_expired(self, jobs: list[tuple[int, dict]]):
+        if NOTIFICATION_DISPATCHER:
+            from monitoring.dispatcher import enqueue_notifications
+            await enqueue_notifications(self.redis, jobs)
+        else:
+            await self._send_directly(jobs)
+
+    async def expire_subscriptions(self, now: float) -> int:
+        # Тексты нужны только при истечении — не тянем translations в импорт api.webhook
+        from utils.translations import translations
+
+        total = 0
+        while due := await self._pop(SUBSCRIPTIONS_KEY, now):
+            user_ids = list(due)
+            try:
+                languages = await self.expire_profiles(keys=[f"zemo:{user_id}" for user_id in user_ids])
+                _forget_matches(user_ids)
+                await self._notify_expired([
+                    (user_id, {"text": translations["stop_expired"][lang if lang in ("ru", "en") else "en"]})
+                    for user_id, lang in zip(user_ids, languages)
+                ])
+            except BaseException:
+                await self._restore(SUBSCRIPTIONS_KEY, due)
+                raise
+            total += len(user_ids)
+        return total
+
+    async def expire_inactive(self, now: float) -> int:
+        """Неактивные дольше inactivity_ttl: удаляем профиль, как делал бы EXPIRE на ключе"""
+        total = 0
+        while due := await self._pop(ACTIVITY_KEY, now - self.inactivity_ttl):
+            user_ids = list(due)
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for user_id in user_ids:
+                        pipe.delete(f"zemo:{user_id}")
+                    pipe.zrem(SUBSCRIPTIONS_KEY, *user_ids)
+                    await pipe.execute()
+                _forget_matches(user_ids)
+            except BaseException:
+                await self._restore(ACTIVITY_KEY, due)
+                raise
+            total += len(user_ids)
+        return total
+
+    async def run_once(self):
+        now = time.time()
+        expired = await self.expire_subscriptions(now)
+        inactive = await self.expire_inactive(now)
+        if expired or inactive:
+            logger.info("⏰ Expired %s subscriptions, removed %s inactive users", expired, inactive)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.exception("❌ Expiry scheduler error: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+activity_tracker = ActivityTracker(redis_client, flush_interval=ACTIVITY_FLUSH_INTERVAL)
+
+async def main():
+    """Отдельный процесс/cron для serverless-развёртывания, где нет фоновых задач"""
+    from utils.redis_client import close_redis
+
+    scheduler = ExpiryScheduler(redis_client)
+    try:
+        await scheduler._loop()
+    finally:
+        if not NOTIFICATION_DISPATCHER:
+            from api.webhook import shutdown_application
+            await shutdown_application()
+        await close_redis()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,7 +2,7 @@
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
 from utils.logger import logger
-from utils.telegram_utils import retry_on_timeout
+from utils.telegram_utils import retry_on_timeout, defer_to_webhook_response
 from utils.translations import translations
 
 
@@ -25,6 +25,10 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     keyboard = get_settings_keyboard(lang)
 
+    if defer_to_webhook_response("sendMessage", chat_id=chat_id, text=welcome_text, reply_markup=keyboard):
+        logger.info("👋 Welcome message and WebApp keyboard returned in webhook response for chat_id=%s", chat_id)
+        return
+
     async def send():
         return await context.bot.send_message(
             chat_id=chat_id,
@@ -33,7 +37,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     await retry_on_timeout(send, chat_id=chat_id, message_text=welcome_text)
-    logger.info(f"👋 Sent welcome message and WebApp keyboard to chat_id={chat_id}")
+    logger.info("👋 Sent welcome message and WebApp keyboard to chat_id=%s", chat_id)
 
 async def welcome_new_user(update: Update, _context: ContextTypes.DEFAULT_TYPE):
     """
@@ -42,7 +46,7 @@ async def welcome_new_user(update: Update, _context: ContextTypes.DEFAULT_TYPE):
     cm = update.my_chat_member
     if cm.chat.type != "private" or cm.new_chat_member.status != "member":
         return
-    logger.info(f"👤 User allowed the bot: chat_id={cm.chat.id}")
+    logger.info("👤 User allowed the bot: chat_id=%s", cm.chat.id)
 
 async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return
@@ -4,13 +4,21 @@ from telegram.ext import ContextTypes
 import re
 from utils.logger import logger
 from utils.translations import translations
-from utils.redis_client import redis_client  # подключаем Redis
+from utils.user_cache import user_cache  # профили из Redis через in-process кэш
+from utils.telegram_utils import defer_to_webhook_response
 #from authorization.subscription import get_user_data, get_user_language
 
 # Временные функции вместо импорта из subscription.py
-def get_user_data(user_id: int) -> dict:
-    """Получаем данные пользователя из Redis"""
-    return redis_client.hgetall(f"zemo:{user_id}") or {}
+# Из профиля здесь нужен только язык
+PROFILE_FIELDS = ("language",)
+
+async def get_user_data(user_id: int) -> dict:
+    """Получаем данные пользователя из кэша/Redis"""
+    return await user_cache.get(user_id, PROFILE_FIELDS)
+
+async def get_users_data(*user_ids: int) -> list[dict]:
+    """Получаем данные нескольких пользователей, промахи кэша — одним pipeline"""
+    return await user_cache.get_many(list(user_ids), PROFILE_FIELDS)
 
 def get_user_language(update: Update, user_data: dict | None) -> str:
     """Определяем язык пользователя"""
@@ -27,7 +35,7 @@ def detect_lang_from_update(update: Update) -> str:
 
 async def handle_support_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug("📥 handle_support_text triggered")
-    logger.debug(f"👤 From user: {update.effective_user.id}, chat: {update.effective_chat.id}")
+    logger.debug("👤 From user: %s, chat: %s", update.effective_user.id, update.effective_chat.id)
 
     # Check if this is a reply to a support message
     if update.message.reply_to_message:
@@ -38,17 +46,23 @@ async def handle_support_text(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply = update.message.text or ""
             if not reply.strip():
                 logger.warning("⚠️ Empty reply message, ignoring")
-                user_data = get_user_data(update.effective_chat.id)
+                user_data = await get_user_data(update.effective_chat.id)
                 lang = get_user_language(update, user_data)
                 error_text = translations['support_empty_reply'][lang]
-                await update.message.reply_text(error_text)
+                if not defer_to_webhook_response("sendMessage", chat_id=update.effective_chat.id, text=error_text,
+                                                 reply_to_message_id=update.message.message_id):
+                    await update.message.reply_text(error_text)
                 return
 
-            logger.debug(f"📤 Sending reply to user {user_id}: {reply}")
+            logger.debug("📤 Sending reply to user %s: %s", user_id, reply)
 
+            # Пока профиль администратора не прочитан — язык из его Telegram-клиента
+            admin_lang = get_user_language(update, None)
             try:
+                # Данные получателя (user_id) и отправителя (администратора) одним запросом
+                user_data, admin_data = await get_users_data(user_id, update.effective_chat.id)
+                admin_lang = get_user_language(update, admin_data)
                 # Получаем язык получателя (user_id)
-                user_data = get_user_data(user_id)
                 lang = get_user_language(update, user_data)
                 reply_text = translations['support_reply'][lang].format(reply=reply)
                 await context.bot.send_message(
@@ -57,16 +71,11 @@ async def handle_support_text(update: Update, context: ContextTypes.DEFAULT_TYPE
                     #text=f"💬 Ответ поддержки:\n{reply}",
                     disable_web_page_preview=True
                 )
-                # Получаем язык отправителя (администратора)
-                admin_data = get_user_data(update.effective_chat.id)
-                admin_lang = get_user_language(update, admin_data)
                 success_text = translations['support_reply_sent'][admin_lang]
                 await update.message.reply_text(success_text)
-                logger.info(f"✅ Ответ отправлен пользователю {user_id}: {reply}")
+                logger.info("✅ Ответ отправлен пользователю %s: %s", user_id, reply)
             except Exception as e:
-                logger.exception(f"❌ Ошибка при отправке ответа пользователю {user_id}: {e}")
-                admin_data = get_user_data(update.effective_chat.id)
-                admin_lang = get_user_language(update, admin_data)
+                logger.exception("❌ Ошибка при отправке ответа пользователю %s: %s", user_id, e)
                 error_text = translations['support_reply_error'][admin_lang].format(error=str(e))
                 await update.message.reply_text(error_text)
         else:
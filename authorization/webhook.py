@@ -4,11 +4,17 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from config import SUPPORT_CHAT_ID
 from utils.logger import logger
-from utils.redis_client import redis_client
-from utils.telegram_utils import retry_on_timeout
+from utils.user_cache import user_cache
+from utils.settings_store import settings_store
+from utils.telegram_utils import retry_on_timeout, defer_to_webhook_response, DURABLE_RETRY_POLICY
 from utils.translations import translations
 
-INACTIVITY_TTL = int(1.2 * 30 * 24 * 60 * 60)  # 1.2 месяца
+# Поля фильтра из WebApp (см. settings_saved в translations)
+SETTINGS_FIELDS = (
+    "city", "districts", "deal_type",
+    "price_from", "price_to", "floor_from", "floor_to",
+    "rooms_from", "rooms_to", "bedrooms_from", "bedrooms_to", "own_ads",
+)
 
 def safe_int(value, default=0):
     try:
@@ -16,6 +22,33 @@ def safe_int(value, default=0):
     except (ValueError, TypeError):
         return default
 
+def normalize_settings(payload: dict) -> dict:
+    """Приводим настройки к строкам для hash zemo:{user_id}"""
+    # matcher тянет NumPy — импортируем только когда настройки действительно сохраняют
+    from monitoring.matcher import parse_districts, parse_flag
+
+    settings = {}
+    for field in SETTINGS_FIELDS:
+        value = payload.get(field)
+        if field == "districts":
+            settings[field] = orjson.dumps(list(parse_districts(value))).decode()
+        elif field == "own_ads":
+            settings[field] = "1" if parse_flag(value) else "0"
+        else:
+            settings[field] = "" if value is None else str(value).strip()
+    return settings
+
+async def save_settings(user_id: int, payload: dict) -> dict:
+    settings = normalize_settings(payload)
+    await settings_store.save(user_id, settings)
+    from monitoring.matcher import subscription_index
+    if subscription_index.loaded:
+        # Индекс есть только в процессе, который сопоставляет объявления; иначе его построят из Redis.
+        # Форма не меняет monitoring — берём его из профиля, чтобы истёкшая подписка не вернулась в индекс
+        state = await user_cache.get(user_id, ("monitoring",))
+        subscription_index.upsert(user_id, {**settings, **state})
+    return settings
+
 async def webhook_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.web_app_data:
         return
@@ -23,9 +56,9 @@ async def webhook_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     try:
         payload = orjson.loads(update.message.web_app_data.data)
-        logger.debug(f"📩 Received Web App data for user_id={user_id}: {payload}")
+        logger.debug("📩 Received Web App data for user_id=%s: %s", user_id, payload)
 
-        user_data = redis_client.hgetall(f"zemo:{user_id}")
+        user_data = await user_cache.get(user_id, ("language",))
         lang = user_data.get("language", update.effective_user.language_code[:2])
         lang = lang if lang in ['ru', 'en'] else 'en'
 
@@ -35,6 +68,8 @@ async def webhook_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message = (payload.get("message") or "").strip()
             if not message:
                 error_text = translations['support_empty'][lang]
+                if defer_to_webhook_response("sendMessage", chat_id=user_id, text=error_text):
+                    return
                 async def send_error():
                     return await context.bot.send_message(chat_id=user_id, text=error_text)
                 await retry_on_timeout(send_error)
@@ -47,15 +82,29 @@ async def webhook_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             async def send_to_support():
                 return await context.bot.send_message(SUPPORT_CHAT_ID, forward_text)
-            await retry_on_timeout(send_to_support)
+            # С NOTIFICATION_DISPATCHER при сбое уходит в очередь повторов, без него — ошибка видна пользователю
+            await retry_on_timeout(send_to_support, policy=DURABLE_RETRY_POLICY,
+                                   payload={"chat_id": SUPPORT_CHAT_ID, "text": forward_text})
 
             response_text = translations['support_sent'][lang]
             async def send_confirmation():
                 return await context.bot.send_message(chat_id=user_id, text=response_text)
             await retry_on_timeout(send_confirmation)
 
+        elif data_type == "settings":
+            settings = await save_settings(user_id, payload)
+            saved_text = translations['settings_saved'][lang].format(
+                **{**settings, "districts": ", ".join(orjson.loads(settings["districts"])) or "—",
+                   "own_ads": "✅" if settings["own_ads"] == "1" else "❌"}
+            )
+            if defer_to_webhook_response("sendMessage", chat_id=user_id, text=saved_text):
+                return
+            async def send_saved():
+                return await context.bot.send_message(chat_id=user_id, text=saved_text)
+            await retry_on_timeout(send_saved)
+
     except Exception as e:
-        logger.error(f"❌ Error processing Web App data for user_id={user_id}: {e}", exc_info=True)
+        logger.error("❌ Error processing Web App data for user_id=%s: %s", user_id, e, exc_info=True)
         error_text = translations['processing_error'][lang]
         async def send_error():
             return await context.bot.send_message(chat_id=user_id, text=error_text)
@@ -0,0 +1,66 @@
+# bench/corpus.py
+"""Синтетические апдейты для бенчмарка: /start, WebApp support, ответы поддержки и my_chat_member"""
+import itertools
+import random
+import time
+import orjson
+from config import SUPPORT_CHAT_ID
+
+KINDS = ("start", "web_app_support", "support_reply", "my_chat_member")
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}", "language_code": "ru"}
+
+def _private_chat(user_id: int) -> dict:
+    return {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": _private_chat(user_id), "from": _user(user_id),
+        "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+def web_app_support_update(update_id: int, user_id: int) -> dict:
+    data = orjson.dumps({"type": "support", "message": f"Вопрос #{update_id}: как работает фильтр?"}).decode()
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": _private_chat(user_id), "from": _user(user_id),
+        "web_app_data": {"data": data, "button_text": "💬 Поддержка"},
+    }}
+
+def support_reply_update(update_id: int, user_id: int) -> dict:
+    chat = {"id": SUPPORT_CHAT_ID, "type": "supergroup", "title": "Support"}
+    admin = _user(999_000_000 + user_id % 10)
+    original = {
+        "message_id": update_id - 1, "date": int(time.time()), "chat": chat, "from": {**_user(1), "is_bot": True},
+        "text": f"📨 Новый вопрос от пользователя User{user_id} (@user{user_id})\nID пользователя: {user_id}\n\nВопрос",
+    }
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": chat, "from": admin,
+        "text": "Ответ поддержки", "reply_to_message": original,
+    }}
+
+def my_chat_member_update(update_id: int, user_id: int) -> dict:
+    bot = {"id": 1, "is_bot": True, "first_name": "Bench"}
+    return {"update_id": update_id, "my_chat_member": {
+        "chat": _private_chat(user_id), "from": _user(user_id), "date": int(time.time()),
+        "old_chat_member": {"status": "kicked", "user": bot, "until_date": 0},
+        "new_chat_member": {"status": "member", "user": bot},
+    }}
+
+BUILDERS = {
+    "start": start_update,
+    "web_app_support": web_app_support_update,
+    "support_reply": support_reply_update,
+    "my_chat_member": my_chat_member_update,
+}
+
+def generate(count: int, kinds=KINDS, seed=0, first_update_id=1, users=10_000) -> list[tuple[str, bytes]]:
+    """(kind, тело запроса) — тела сериализуются заранее, чтобы не мерить генератор"""
+    rng = random.Random(seed)
+    update_ids = itertools.count(first_update_id)
+    corpus = []
+    for _ in range(count):
+        kind = rng.choice(kinds)
+        user_id = rng.randrange(1, users)
+        corpus.append((kind, orjson.dumps(BUILDERS[kind](next(update_ids), user_id))))
+    return corpus
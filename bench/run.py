@@ -0,0 +1,263 @@
+# bench/run.py
+"""
+Нагрузочный бенчмарк /telegram-webhook.
+
+Поднимает стаб Telegram Bot API, Redis (fakeredis по TCP, если не задан --redis-url) и приложение
+в uvicorn, затем гоняет синтетические апдейты с растущей конкуренцией и сохраняет результаты:
+
+    python -m bench.run --levels 1,8,32,128 --requests 1000 --latency 0.05 --error-rate 0.01
+    python -m bench.run --env ACCEPT_FAST=1 --compare bench/results/<предыдущий>.json
+    python -m bench.run --workers 4   # долгоживущий режим serve.py: фронт + 4 процесса-обработчика
+
+Зависимости бенчмарка: bench/requirements.txt.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import httpx
+import orjson
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "bench" / "results"
+TOKEN = "123456:bench"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def peak_rss_kb(pid: int) -> int:
+    """VmHWM — пиковый RSS процесса (Linux)"""
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def process_tree(pid: int) -> list[int]:
+    """pid и все его потомки (Linux): в режиме --workers приложение — это supervisor и его дети"""
+    pids = [pid]
+    try:
+        for task in Path(f"/proc/{pid}/task").iterdir():
+            for child in (task / "children").read_text().split():
+                pids += process_tree(int(child))
+    except OSError:
+        pass
+    return pids
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def start_fake_redis() -> str:
+    from fakeredis import TcpFakeServer
+
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+async def wait_ready(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with code {process.returncode}")
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"{url} not ready in {timeout}s")
+
+async def wait_workers(client: httpx.AsyncClient, app_url: str, process: subprocess.Popen, timeout=60.0):
+    """В режиме воркеров ждём heartbeat от всех процессов-обработчиков"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with code {process.returncode}")
+        if (await client.get(f"{app_url}/health/workers")).status_code == 200:
+            return
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"Update workers not ready in {timeout}s")
+
+async def outbound_calls(client: httpx.AsyncClient, stub_url: str, settle=0.5, timeout=30.0) -> tuple[dict, float]:
+    """
+    Ждём, пока фоновые отправки (accept-fast, воркеры, повторы) перестанут прибавляться.
+    Возвращает статистику стаба и момент (perf_counter), когда она менялась в последний раз.
+    """
+    deadline = time.monotonic() + timeout
+    previous = None
+    changed_at = time.perf_counter()
+    while True:
+        stats = (await client.get(f"{stub_url}/__stats")).json()
+        if stats == previous or time.monotonic() > deadline:
+            return stats, changed_at
+        previous = stats
+        changed_at = time.perf_counter()
+        await asyncio.sleep(settle)
+
+async def run_level(client: httpx.AsyncClient, app_url: str, stub_url: str, corpus: list, concurrency: int) -> dict:
+    await client.post(f"{stub_url}/__reset")
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    queue = iter(corpus)
+
+    async def worker():
+        for _kind, body in queue:
+            started = time.perf_counter()
+            response = await client.post(f"{app_url}/telegram-webhook", content=body,
+                                         headers={"content-type": "application/json"})
+            latencies.append(time.perf_counter() - started)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stats, drained_at = await outbound_calls(client, stub_url)
+    calls = sum(count for method, count in stats["calls"].items() if method != "getMe")
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(corpus),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(corpus) / elapsed, 1),
+        # Сколько апдейтов в секунду реально обработано: в фоновых режимах ответ приходит раньше обработки
+        "processed_rps": round(len(corpus) / max(drained_at - started, elapsed), 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "statuses": statuses,
+        "outbound_calls": stats["calls"],
+        "outbound_429": stats["errors"],
+        "outbound_per_update": round(calls / len(corpus), 3),
+    }
+
+def print_table(result: dict, baseline: dict | None = None):
+    base_levels = {level["concurrency"]: level for level in (baseline or {}).get("levels", [])}
+    print(f"{'conc':>5} {'rps':>9} {'done/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'out/upd':>8} {'rss MB':>7}")
+    for level in result["levels"]:
+        line = (f"{level['concurrency']:>5} {level['rps']:>9} {level.get('processed_rps', '-'):>9} "
+                f"{level['p50_ms']:>9} {level['p99_ms']:>9} "
+                f"{level['outbound_per_update']:>8} {level['peak_rss_kb'] / 1024:>7.1f}")
+        base = base_levels.get(level["concurrency"])
+        if base:
+            delta_rps = (level["rps"] / base["rps"] - 1) * 100 if base["rps"] else 0.0
+            delta_p99 = (level["p99_ms"] / base["p99_ms"] - 1) * 100 if base["p99_ms"] else 0.0
+            line += f"   rps {delta_rps:+.1f}%  p99 {delta_p99:+.1f}%  (vs {baseline['revision']})"
+        print(line)
+
+async def bench(args) -> dict:
+    redis_url = args.redis_url or start_fake_redis()
+    stub_port, app_port = free_port(), free_port()
+    stub_url, app_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+
+    stub = subprocess.Popen([
+        sys.executable, "-m", "bench.telegram_stub", "--port", str(stub_port),
+        "--latency", str(args.latency), "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+    ], cwd=ROOT)
+    env = {
+        **os.environ,
+        "TELEGRAM_TOKEN": TOKEN,
+        "REDIS_URL": redis_url,
+        "TELEGRAM_API_BASE_URL": f"{stub_url}/bot",
+        "LOG_LEVEL": "WARNING",
+        "STARTUP_REPORT": "0",
+        **dict(item.split("=", 1) for item in args.env),
+    }
+    if args.workers:
+        app = subprocess.Popen([
+            sys.executable, "serve.py", "--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(app_port),
+        ], cwd=ROOT, env=env)
+    else:
+        app = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "api.webhook:app", "--host", "127.0.0.1", "--port", str(app_port),
+            "--log-level", "warning", "--no-access-log",
+        ], cwd=ROOT, env=env)
+
+    limits = httpx.Limits(max_connections=max(args.levels) + 8, max_keepalive_connections=max(args.levels) + 8)
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            await wait_ready(client, f"{stub_url}/__stats", stub)
+            await wait_ready(client, f"{app_url}/metrics", app)
+            if args.workers:
+                await wait_workers(client, app_url, app)
+
+            # corpus берёт SUPPORT_CHAT_ID из config, которому нужны обязательные переменные
+            os.environ.setdefault("TELEGRAM_TOKEN", TOKEN)
+            os.environ.setdefault("REDIS_URL", redis_url)
+            from bench.corpus import generate
+
+            kinds = tuple(args.kinds.split(","))
+            # Разогрев: ленивые импорты хендлеров и соединения не должны попадать в первый уровень
+            await run_level(client, app_url, stub_url, generate(len(kinds) * 4, kinds, seed=-1, first_update_id=1), 4)
+
+            levels = []
+            first_update_id = 1_000_000
+            for concurrency in args.levels:
+                corpus = generate(args.requests, kinds, seed=concurrency, first_update_id=first_update_id)
+                first_update_id += args.requests
+                level = await run_level(client, app_url, stub_url, corpus, concurrency)
+                level["peak_rss_kb"] = sum(peak_rss_kb(pid) for pid in process_tree(app.pid))
+                levels.append(level)
+                print(f"  concurrency={concurrency}: {level['rps']} rps, p99 {level['p99_ms']} ms", flush=True)
+    finally:
+        for process in (app, stub):
+            process.terminate()
+        for process in (app, stub):
+            process.wait(10)
+
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "requests": args.requests, "latency": args.latency, "error_rate": args.error_rate, "seed": args.seed,
+            "kinds": args.kinds, "env": args.env, "redis": "external" if args.redis_url else "fakeredis",
+            "workers": args.workers,
+        },
+        "levels": levels,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,8,32,128", type=lambda v: [int(x) for x in v.split(",")])
+    parser.add_argument("--requests", type=int, default=1000, help="апдейтов на уровень конкуренции")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка стаба Bot API, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429 от стаба")
+    parser.add_argument("--seed", type=int, default=0, help="seed 429 стаба — для воспроизводимых прогонов")
+    parser.add_argument("--kinds", default=",".join(("start", "web_app_support", "support_reply", "my_chat_member")))
+    parser.add_argument("--env", action="append", default=[], help="переменная окружения приложения, KEY=VALUE")
+    parser.add_argument("--redis-url", help="настоящий Redis вместо fakeredis")
+    parser.add_argument("--workers", type=int, default=0, help="режим serve.py с таким числом процессов-обработчиков")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--compare", type=Path, help="прошлый результат для сравнения")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    args.output.mkdir(parents=True, exist_ok=True)
+    path = args.output / f"{result['timestamp'].replace(':', '')}-{result['revision']}.json"
+    path.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    baseline = orjson.loads(args.compare.read_bytes()) if args.compare else None
+    print_table(result, baseline)
+    print(f"Saved {path.relative_to(ROOT) if path.is_relative_to(ROOT) else path}")
+
+if __name__ == "__main__":
+    main()
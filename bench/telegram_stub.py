@@ -0,0 +1,112 @@
+# bench/telegram_stub.py
+"""
+Локальная замена Telegram Bot API для бенчмарка.
+
+    python -m bench.telegram_stub --port 8081 --latency 0.05 --error-rate 0.01
+
+Каждый вызов ждёт latency секунд; с вероятностью error-rate отвечает 429 с retry_after.
+GET /__stats отдаёт число вызовов по методам, POST /__reset обнуляет счётчики.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+import orjson
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class StubState:
+    def __init__(self, latency: float, error_rate: float, retry_after: int, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.random = random.Random(seed)  # свой генератор: одинаковые 429 при одинаковом seed
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.message_id = 0
+
+
+def json_response(payload: dict, status_code=200) -> Response:
+    return Response(orjson.dumps(payload), status_code=status_code, media_type="application/json")
+
+async def read_params(request: Request) -> dict:
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return orjson.loads(body or b"{}")
+    # PTB шлёт application/x-www-form-urlencoded, значения — JSON
+    params = {}
+    for key, value in parse_qsl(body.decode()):
+        try:
+            params[key] = orjson.loads(value)
+        except orjson.JSONDecodeError:
+            params[key] = value
+    return params
+
+def build_app(state: StubState) -> Starlette:
+    async def bot_method(request: Request):
+        method = request.path_params["method"]
+        params = await read_params(request)
+        state.calls[method] += 1
+        if state.latency:
+            await asyncio.sleep(state.latency)
+
+        if method != "getMe" and state.random.random() < state.error_rate:
+            state.errors[method] += 1
+            return json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {state.retry_after}",
+                "parameters": {"retry_after": state.retry_after},
+            }, status_code=429)
+
+        if method == "getMe":
+            return json_response({"ok": True, "result": BOT_USER})
+        if method in ("sendMessage", "copyMessage", "forwardMessage"):
+            state.message_id += 1
+            chat_id = params.get("chat_id", 0)
+            return json_response({"ok": True, "result": {
+                "message_id": state.message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "supergroup"},
+                "from": BOT_USER, "text": params.get("text", ""),
+            }})
+        return json_response({"ok": True, "result": True})
+
+    async def stats(_request: Request):
+        return json_response({"calls": dict(state.calls), "errors": dict(state.errors)})
+
+    async def reset(_request: Request):
+        state.calls.clear()
+        state.errors.clear()
+        state.random.seed(state.seed)  # каждый уровень бенчмарка получает ту же последовательность
+        return json_response({"ok": True})
+
+    return Starlette(routes=[
+        Route("/__stats", stats, methods=["GET"]),
+        Route("/__reset", reset, methods=["POST"]),
+        Route("/bot{token}/{method}", bot_method, methods=["GET", "POST"]),
+    ])
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора 429")
+    args = parser.parse_args()
+    state = StubState(args.latency, args.error_rate, args.retry_after, args.seed)
+    uvicorn.run(build_app(state), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
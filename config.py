@@ -8,13 +8,41 @@ REDIS_URL = os.getenv("REDIS_URL")
 ZEMO_WEBHOOK_URL = f"https://{os.getenv('VERCEL_URL', 'localhost:3001')}/{TELEGRAM_TOKEN}"  # Vercel auto VERCEL_URL, fallback for local
 PORT = int(os.getenv("PORT", 3001))  # Vercel PORT auto
 MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "zemo")
+SETTINGS_FLUSH_INTERVAL = float(os.getenv("SETTINGS_FLUSH_INTERVAL", 5))  # write-behind в MongoDB не реже, секунд
+SETTINGS_FLUSH_BATCH = int(os.getenv("SETTINGS_FLUSH_BATCH", 500))  # или сразу при таком числе изменений
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))  # размер пула asyncio Redis
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")  # "local" или "redis" (общий лимит для всех инстансов)
+REDIS_RATE_LIMIT_TIMEOUT = float(os.getenv("REDIS_RATE_LIMIT_TIMEOUT", 0.05))  # дольше — переходим на локальный лимитер
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))  # профилей в in-process кэше
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 30))  # секунд жизни профиля в кэше
+USER_CACHE_CONFIGURE_NOTIFICATIONS = os.getenv("USER_CACHE_CONFIGURE_NOTIFICATIONS", "0") == "1"  # разрешить CONFIG SET notify-keyspace-events на сервере Redis
+STARTUP_REPORT = os.getenv("STARTUP_REPORT", "1") == "1"  # лог стоимости фаз холодного старта
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")  # свой Bot API сервер или стаб бенчмарка
+BOT_CONNECTION_POOL_SIZE = int(os.getenv("BOT_CONNECTION_POOL_SIZE", 64))  # пул HTTP-соединений бота
+ACCEPT_FAST = os.getenv("ACCEPT_FAST", "0") == "1"  # отвечать 200 сразу и обрабатывать апдейты в фоне
+REPLY_IN_RESPONSE = os.getenv("REPLY_IN_RESPONSE", "0") == "1"  # отдавать единственный ответ хендлера в теле webhook-ответа
+NOTIFICATION_DISPATCHER = os.getenv("NOTIFICATION_DISPATCHER", "0") == "1"  # запущен python -m monitoring.dispatcher: неудачные отправки уходят в его очередь
+FAST_PATH_ROUTING = os.getenv("FAST_PATH_ROUTING", "1") == "1"  # маршрутизация по сырому JSON до Update.de_json
+EXPIRY_INTERVAL = float(os.getenv("EXPIRY_INTERVAL", 60))  # период воркера истечения подписок, секунды
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", 10))  # как часто писать накопленную активность
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 8))  # одновременно работающих хендлеров очереди апдейтов
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))  # общий лимит очереди апдейтов
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", 3600))  # сколько помним обработанные update_id
+WORKER_MODE = os.getenv("WORKER_MODE", "0") == "1"  # фронт кладёт апдейты в Redis streams, обрабатывают процессы api.worker
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1))  # число процессов-обработчиков апдейтов
+UPDATE_SHARDS = int(os.getenv("UPDATE_SHARDS", 64))  # шардов (streams) по chat_id; больше числа воркеров
+UPDATE_STREAM_MAXLEN = int(os.getenv("UPDATE_STREAM_MAXLEN", 100000))  # примерный предел длины stream шарда
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", 10))  # сколько воркер дорабатывает при остановке
+SENT_FILTER_CAPACITY = int(os.getenv("SENT_FILTER_CAPACITY", 2000))  # листингов на пользователя за окно
+SENT_FILTER_ERROR_RATE = float(os.getenv("SENT_FILTER_ERROR_RATE", 0.001))  # доля ложных "уже отправляли"
+SENT_FILTER_WINDOW = int(os.getenv("SENT_FILTER_WINDOW", 14 * 86400))  # окно Bloom-фильтра, секунды
 
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN not found")
 if not REDIS_URL:
     raise ValueError("REDIS_URL not found")
-if not MONGO_URI:
-    raise ValueError("MONGO_URI не найден в переменных окружения")
+# MONGO_URI проверяется при первом подключении к MongoDB: на пути запроса он не нужен
 
 
 
@@ -0,0 +1,244 @@
+# monitoring/dispatcher.py
+import asyncio
+import itertools
+import os
+import time
+import orjson
+from redis.exceptions import ResponseError
+from telegram.error import BadRequest, Forbidden
+from utils.logger import logger
+from utils.sent_filter import sent_filter
+from utils.telegram_utils import TokenBucket, retry_on_timeout
+
+INTERACTIVE_STREAM = "notifications:interactive"
+BULK_STREAM = "notifications:bulk"
+GROUP = "dispatcher"
+
+# Меньше — раньше в локальной очереди отправки
+PRIORITIES = {INTERACTIVE_STREAM: 0, BULK_STREAM: 1}
+
+def _job_fields(chat_id: int, payload: dict, listing_id=None) -> dict:
+    fields = {"chat_id": chat_id, "payload": orjson.dumps(payload)}
+    if listing_id is not None:
+        fields["listing_id"] = listing_id
+    return fields
+
+async def enqueue_notification(redis, chat_id: int, payload: dict, interactive=False, maxlen=1_000_000, listing_id=None):
+    """Кладёт задание (chat_id, payload) в постоянный Redis stream; listing_id включает фильтр повторов"""
+    stream = INTERACTIVE_STREAM if interactive else BULK_STREAM
+    await redis.xadd(stream, _job_fields(chat_id, payload, listing_id), maxlen=maxlen, approximate=True)
+
+async def enqueue_notifications(redis, jobs, interactive=False, maxlen=1_000_000):
+    """Пачка заданий (chat_id, payload[, listing_id]) одним pipeline — для рассылки по совпавшим подписчикам"""
+    stream = INTERACTIVE_STREAM if interactive else BULK_STREAM
+    async with redis.pipeline(transaction=False) as pipe:
+        for job in jobs:
+            pipe.xadd(stream, _job_fields(*job), maxlen=maxlen, approximate=True)
+        await pipe.execute()
+
+
+class BroadcastDispatcher:
+    """
+    Читает задания из Redis streams через consumer group и отправляет их с ограниченной конкуренцией.
+    Интерактивные ответы идут впереди массовых уведомлений, а массовые ограничены bulk_rate,
+    чтобы часть глобального лимита Telegram всегда оставалась под интерактив.
+    """
+    def __init__(self, redis, bot, concurrency=32, bulk_rate=25, batch_size=100,
+                 consumer=None, claim_idle_ms=60_000, report_interval=30):
+        self.redis = redis
+        self.bot = bot
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.consumer = consumer or f"{os.uname().nodename}-{os.getpid()}"
+        self.claim_idle_ms = claim_idle_ms
+        self.report_interval = report_interval
+        self.bulk_bucket = TokenBucket(bulk_rate)
+        # Небольшой буфер: читаем из stream только под свободные места, чтобы интерактивное
+        # задание не ждало в Redis, пока локально разбирается длинная пачка bulk
+        self.buffer_size = concurrency * 2
+        self.jobs: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.room = asyncio.Event()
+        self.sequence = itertools.count()
+        self.local_ids: set[str] = set()  # задания в буфере или в отправке — повторно не забираем
+        self.tasks: list[asyncio.Task] = []
+        self.stopping = asyncio.Event()
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+
+    async def _ensure_groups(self):
+        for stream in PRIORITIES:
+            try:
+                await self.redis.xgroup_create(stream, GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def _drop_already_sent(self, stream: str, entries) -> list:
+        """
+        Одна проверка Bloom-фильтра на всю пачку: уже отправленные листинги подтверждаем сразу,
+        не занимая ими буфер и лимиты. Окончательное атомарное решение принимает отправка.
+        """
+        with_listing = [(entry_id, fields) for entry_id, fields in entries if fields.get("listing_id")]
+        if not with_listing:
+            return entries
+        pairs = [(int(fields["chat_id"]), fields["listing_id"]) for _, fields in with_listing]
+        sent = {entry_id for (entry_id, _), seen in zip(with_listing, await sent_filter.contains(pairs)) if seen}
+        if sent:
+            await self.redis.xack(stream, GROUP, *sent)
+            self.skipped += len(sent)
+        return [(entry_id, fields) for entry_id, fields in entries if entry_id not in sent]
+
+    def _put(self, stream: str, entries):
+        for entry_id, fields in entries:
+            if entry_id in self.local_ids:
+                continue
+            self.local_ids.add(entry_id)
+            self.jobs.put_nowait((PRIORITIES[stream], next(self.sequence), stream, entry_id, fields))
+
+    async def _claim_stale(self):
+        """Забираем задания, зависшие у упавших потребителей или неподтверждённые после сбоя отправки"""
+        for stream in PRIORITIES:
+            start = "0-0"
+            while True:
+                start, entries, _ = await self.redis.xautoclaim(
+                    stream, GROUP, self.consumer, self.claim_idle_ms, start_id=start, count=self.batch_size
+                )
+                entries = [(entry_id, fields) for entry_id, fields in entries if entry_id not in self.local_ids]
+                self._put(stream, await self._drop_already_sent(stream, entries))
+                if start in ("0-0", b"0-0") or not entries:
+                    break
+
+    async def _fetcher(self):
+        claimed_at = None  # первый проход — сразу при старте
+        while not self.stopping.is_set():
+            # Неудачные отправки остаются в pending: периодически забираем их снова
+            if claimed_at is None or time.monotonic() - claimed_at >= self.claim_idle_ms / 1000:
+                try:
+                    await self._claim_stale()
+                except Exception as e:
+                    logger.warning("⚠️ Failed to claim stale notifications: %r", e)
+                claimed_at = time.monotonic()
+            while self.jobs.qsize() >= self.buffer_size:
+                self.room.clear()
+                await self.room.wait()
+            try:
+                response = await self.redis.xreadgroup(
+                    GROUP, self.consumer, {stream: ">" for stream in PRIORITIES},
+                    count=min(self.batch_size, self.buffer_size - self.jobs.qsize()), block=1000,
+                )
+                for stream, entries in response or []:
+                    self._put(stream, await self._drop_already_sent(stream, entries))
+            except Exception as e:
+                # Прочитанное, но не взятое в работу, останется в pending и будет забрано повторно
+                logger.warning("⚠️ Failed to read notification streams: %r", e)
+                await asyncio.sleep(1)
+
+    async def _wait_bulk_slot(self):
+        now = time.monotonic()
+        send_at = self.bulk_bucket.earliest(now)
+        self.bulk_bucket.consume(send_at)
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def _sender(self):
+        while True:
+            priority, _, stream, entry_id, fields = await self.jobs.get()
+            self.room.set()
+            try:
+                chat_id = int(fields["chat_id"])
+                payload = orjson.loads(fields["payload"])
+                if priority:
+                    await self._wait_bulk_slot()
+
+                async def send():
+                    return await self.bot.send_message(chat_id=chat_id, **payload)
+                await retry_on_timeout(send, chat_id=chat_id, message_text=payload.get("text"),
+                                       listing_id=fields.get("listing_id"))
+                self.sent += 1
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+                logger.warning("⚠️ Dropping notification for chat_id=%s: %s", fields.get('chat_id'), e)
+                self.failed += 1
+            except Exception as e:
+                # Не подтверждаем: задание останется в pending и будет забрано повторно
+                logger.exception("❌ Notification to chat_id=%s failed: %s", fields.get('chat_id'), e)
+                self.failed += 1
+                continue
+            finally:
+                self.local_ids.discard(entry_id)
+                self.jobs.task_done()
+            try:
+                await self.redis.xack(stream, GROUP, entry_id)
+            except Exception as e:
+                # Останется в pending и будет забрано повторно; с listing_id повтор отсеет фильтр отправленных
+                logger.warning("⚠️ Failed to ack notification %s: %r", entry_id, e)
+
+    async def stats(self) -> dict:
+        """Пропускная способность и глубина очередей"""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        depth = {}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for stream in PRIORITIES:
+                pipe.xlen(stream)
+                pipe.xpending(stream, GROUP)
+            results = await pipe.execute()
+        for stream, length, pending in zip(PRIORITIES, results[::2], results[1::2]):
+            depth[stream] = {"length": length, "pending": pending["pending"]}
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped_duplicates": self.skipped,
+            "messages_per_second": round(self.sent / elapsed, 2),
+            "buffered": self.jobs.qsize(),
+            "streams": depth,
+        }
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            try:
+                logger.info("📊 Dispatcher stats: %s", await self.stats())
+            except Exception as e:
+                logger.warning("⚠️ Failed to collect dispatcher stats: %r", e)
+
+    async def start(self):
+        await self._ensure_groups()
+        self.started_at = time.monotonic()
+        self.tasks = [asyncio.create_task(self._fetcher()), asyncio.create_task(self._reporter())]
+        self.tasks += [asyncio.create_task(self._sender()) for _ in range(self.concurrency)]
+        logger.info("📬 Broadcast dispatcher started: consumer=%s, concurrency=%s", self.consumer, self.concurrency)
+
+    async def stop(self, drain_timeout=10.0):
+        self.stopping.set()
+        self.room.set()
+        fetcher, *others = self.tasks
+        await asyncio.gather(fetcher, return_exceptions=True)
+        try:
+            # Неподтверждённые задания останутся в pending и будут забраны при следующем запуске
+            await asyncio.wait_for(self.jobs.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Dispatcher stopped with %s buffered jobs left pending", self.jobs.qsize())
+        for task in others:
+            task.cancel()
+        await asyncio.gather(*others, return_exceptions=True)
+        self.tasks = []
+
+
+async def main():
+    from api.webhook import get_application, shutdown_application
+    from utils.redis_client import redis_client, close_redis
+
+    application = await get_application()
+    dispatcher = BroadcastDispatcher(redis_client, application.bot)
+    await dispatcher.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await dispatcher.stop()
+        await shutdown_application()
+        await close_redis()
+
+if __name__ == "__main__":
+    asyncio.run(main())
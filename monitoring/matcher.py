@@ -0,0 +1,242 @@
+# monitoring/matcher.py
+import asyncio
+import numpy as np
+import orjson
+from collections import defaultdict
+from utils.logger import logger
+
+# Числовые диапазоны фильтра: колонка индекса -> (поле "от", поле "до", поле объявления)
+RANGE_FIELDS = (
+    ("price_from", "price_to", "price"),
+    ("floor_from", "floor_to", "floor"),
+    ("rooms_from", "rooms_to", "rooms"),
+    ("bedrooms_from", "bedrooms_to", "bedrooms"),
+)
+TRUE_VALUES = {"1", "true", "yes", "on", "да"}
+
+def parse_bound(value, default: float) -> float:
+    """Граница диапазона; пустое или некорректное значение — без ограничения"""
+    try:
+        return float(str(value).replace(" ", ""))
+    except (ValueError, TypeError):
+        return default
+
+def parse_districts(value) -> tuple[str, ...]:
+    """Районы приходят списком, JSON-строкой или строкой через запятую"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        try:
+            value = orjson.loads(value)
+        except orjson.JSONDecodeError:
+            value = value.split(",")
+    if isinstance(value, str):
+        value = [value]
+    return tuple(sorted({str(d).strip().lower() for d in value if str(d).strip()}))
+
+def parse_flag(value) -> bool:
+    return str(value).strip().lower() in TRUE_VALUES
+
+def _key(value) -> str:
+    return str(value or "").strip().lower()
+
+# Пустой тип сделки в фильтре — "любой"
+ANY = ""
+
+
+class SubscriptionIndex:
+    """
+    In-memory индекс фильтров подписчиков.
+    Город, тип сделки и районы — точные корзины (dict -> set слотов), числовые диапазоны — колонки NumPy,
+    поэтому объявление сравнивается только с кандидатами из своих корзин и векторно.
+    """
+    def __init__(self, capacity=1024):
+        self.lows = np.full((capacity, len(RANGE_FIELDS)), -np.inf)
+        self.highs = np.full((capacity, len(RANGE_FIELDS)), np.inf)
+        self.owner_only = np.zeros(capacity, dtype=bool)
+        self.user_ids = np.zeros(capacity, dtype=np.int64)
+        self.slots: dict[int, int] = {}  # user_id -> строка в колонках
+        self.bucket_keys: dict[int, list[tuple]] = {}  # user_id -> корзины, где он лежит
+        self.free_slots: list[int] = []
+        self.next_slot = 0
+        # (city, deal_type) -> слоты без фильтра по району; (city, deal_type, district) -> слоты района
+        self.buckets: defaultdict[tuple, set[int]] = defaultdict(set)
+        self._bucket_arrays: dict[tuple, np.ndarray] = {}  # кэш корзин в виде массивов
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        capacity = len(self.user_ids) * 2
+        for name, fill in (("lows", -np.inf), ("highs", np.inf)):
+            old = getattr(self, name)
+            new = np.full((capacity, old.shape[1]), fill)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.owner_only = np.concatenate([self.owner_only, np.zeros(capacity - len(self.owner_only), dtype=bool)])
+        self.user_ids = np.concatenate([self.user_ids, np.zeros(capacity - len(self.user_ids), dtype=np.int64)])
+
+    def _allocate_slot(self) -> int:
+        if self.free_slots:
+            return self.free_slots.pop()
+        if self.next_slot == len(self.user_ids):
+            self._grow()
+        self.next_slot += 1
+        return self.next_slot - 1
+
+    def _bucket_array(self, key: tuple) -> np.ndarray:
+        array = self._bucket_arrays.get(key)
+        if array is None:
+            array = self._bucket_arrays[key] = np.fromiter(self.buckets.get(key, ()), dtype=np.int64)
+        return array
+
+    def _add_to_bucket(self, key: tuple, slot: int):
+        self.buckets[key].add(slot)
+        self._bucket_arrays.pop(key, None)
+
+    def _remove_from_bucket(self, key: tuple, slot: int):
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.discard(slot)
+            if not bucket:
+                del self.buckets[key]
+        self._bucket_arrays.pop(key, None)
+
+    def remove(self, user_id: int):
+        slot = self.slots.pop(user_id, None)
+        if slot is None:
+            return
+        for key in self.bucket_keys.pop(user_id, ()):
+            self._remove_from_bucket(key, slot)
+        self.free_slots.append(slot)
+
+    def upsert(self, user_id: int, settings: dict):
+        """Добавляет или обновляет фильтр пользователя; вызывается при сохранении настроек"""
+        self.remove(user_id)
+        if _key(settings.get("monitoring")) == "0":
+            return  # подписка истекла — объявления не сопоставляем
+        city, deal_type = _key(settings.get("city")), _key(settings.get("deal_type"))
+        if not city:
+            return  # без города фильтр не настроен
+
+        slot = self._allocate_slot()
+        self.slots[user_id] = slot
+        self.user_ids[slot] = user_id
+        for column, (low_field, high_field, _) in enumerate(RANGE_FIELDS):
+            self.lows[slot, column] = parse_bound(settings.get(low_field), -np.inf)
+            self.highs[slot, column] = parse_bound(settings.get(high_field), np.inf)
+        self.owner_only[slot] = parse_flag(settings.get("own_ads"))
+
+        districts = parse_districts(settings.get("districts"))
+        keys = [(city, deal_type, d) for d in districts] if districts else [(city, deal_type)]
+        for key in keys:
+            self._add_to_bucket(key, slot)
+        self.bucket_keys[user_id] = keys
+
+    def _candidates(self, city: str, deal_type: str, district: str) -> np.ndarray:
+        deal_types = (deal_type, ANY) if deal_type != ANY else (ANY,)
+        return np.concatenate([
+            array
+            for deal in deal_types
+            for array in (self._bucket_array((city, deal)), self._bucket_array((city, deal, district)))
+        ])
+
+    def _filter(self, candidates: np.ndarray, values: np.ndarray, owner: np.ndarray) -> np.ndarray:
+        """
+        Маска (кандидаты x объявления): все числовые диапазоны содержат значение объявления,
+        а "только собственник" пропускает лишь объявления собственников.
+        Отсутствующее значение объявления (NaN) диапазоном не ограничивается.
+        """
+        lows = self.lows[candidates][:, None, :]
+        highs = self.highs[candidates][:, None, :]
+        values = values[None, :, :]
+        in_range = np.isnan(values) | ((lows <= values) & (values <= highs))
+        mask = in_range.all(axis=2)
+        mask &= ~self.owner_only[candidates][:, None] | owner[None, :]
+        return mask
+
+    @staticmethod
+    def _listing_row(listing: dict) -> list[float]:
+        return [parse_bound(listing.get(field), np.nan) for _, _, field in RANGE_FIELDS]
+
+    @staticmethod
+    def _listing_key(listing: dict) -> tuple[str, str, str]:
+        return _key(listing.get("city")), _key(listing.get("deal_type")), _key(listing.get("district"))
+
+    def match(self, listing: dict) -> np.ndarray:
+        """user_id подписчиков, чьи фильтры подходят под объявление"""
+        return self.match_batch([listing])[0]
+
+    def match_batch(self, listings: list[dict]) -> list[np.ndarray]:
+        """
+        Сопоставляет пачку объявлений за один вызов.
+        Объявления группируются по корзине, и каждая группа проверяется одной векторной операцией.
+        """
+        results = [np.empty(0, dtype=np.int64)] * len(listings)
+        groups: defaultdict[tuple, list[int]] = defaultdict(list)
+        for position, listing in enumerate(listings):
+            groups[self._listing_key(listing)].append(position)
+
+        for key, positions in groups.items():
+            candidates = self._candidates(*key)
+            if not len(candidates):
+                continue
+            values = np.array([self._listing_row(listings[p]) for p in positions], dtype=float)
+            owner = np.array([parse_flag(listings[p].get("is_owner")) for p in positions], dtype=bool)
+            mask = self._filter(candidates, values, owner)
+            user_ids = self.user_ids[candidates]
+            for column, position in enumerate(positions):
+                results[position] = user_ids[mask[:, column]]
+        return results
+
+    async def load_from_redis(self, redis, pattern="zemo:*", batch_size=500):
+        """Строит индекс из сохранённых настроек: SCAN + pipeline HGETALL пачками"""
+        loaded = 0
+        keys = []
+        async for key in redis.scan_iter(match=pattern, count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                loaded += await self._load_keys(redis, keys)
+                keys = []
+        if keys:
+            loaded += await self._load_keys(redis, keys)
+        self.loaded = True
+        logger.info("🗂 Subscription index built: %s filters", loaded)
+
+    async def _load_keys(self, redis, keys: list[str]) -> int:
+        # Только хеши профилей zemo:{user_id}: рядом могут лежать служебные ключи других типов
+        keys = [key for key in keys if key.partition(":")[2].isdigit()]
+        if not keys:
+            return 0
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            profiles = await pipe.execute()
+        loaded = 0
+        for key, profile in zip(keys, profiles):
+            user_id = int(key.partition(":")[2])
+            if profile:
+                self.upsert(user_id, profile)
+                loaded += user_id in self.slots
+        return loaded
+
+# Общий индекс процесса
+subscription_index = SubscriptionIndex()
+_index_lock = asyncio.Lock()
+
+async def ensure_subscription_index(redis):
+    """
+    Строит индекс процесса из Redis один раз — при первом сопоставлении объявлений.
+    Процессы, которые только сохраняют настройки, индекс не строят.
+    """
+    if not subscription_index.loaded:
+        async with _index_lock:
+            if not subscription_index.loaded:
+                await subscription_index.load_from_redis(redis)
+    return subscription_index
+
+async def match_listings(redis, listings: list[dict]) -> list[np.ndarray]:
+    """match_batch для процесса, который сопоставляет объявления: индекс строится при первом вызове"""
+    index = await ensure_subscription_index(redis)
+    return index.match_batch(listings)
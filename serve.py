@@ -0,0 +1,87 @@
+#  serve.py
+"""
+Долгоживущий режим для собственного хостинга: все ядра вместо одного процесса uvicorn.
+
+Поднимает FastAPI-фронт (uvicorn, --web-workers процессов), который только кладёт апдейты в Redis
+streams по хешу chat_id, и --workers процессов api.worker, которые их обрабатывают. Упавший воркер
+перезапускается с тем же номером и дочитывает свои неподтверждённые апдейты. SIGTERM/SIGINT:
+сначала останавливается фронт, затем воркеры дорабатывают принятое (WORKER_DRAIN_TIMEOUT).
+
+    python serve.py --workers 4 --web-workers 2
+
+Здоровье воркеров: GET /health/workers.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from config import WORKER_DRAIN_TIMEOUT
+from utils.logger import logger
+
+ROOT = Path(__file__).resolve().parent
+
+def spawn_worker(index: int, count: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "api.worker", "--index", str(index), "--count", str(count)], cwd=ROOT, env=env,
+    )
+
+def stop_processes(processes: list[subprocess.Popen], timeout: float):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            logger.warning("⚠️ %s did not stop in %ss, killing", process.args, timeout)
+            process.kill()
+            process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов-обработчиков апдейтов")
+    parser.add_argument("--web-workers", type=int, default=1, help="процессов uvicorn для фронта")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 3001)))
+    args = parser.parse_args()
+
+    env = {**os.environ, "WORKER_MODE": "1", "WORKER_PROCESSES": str(args.workers)}
+    workers = [spawn_worker(index, args.workers, env) for index in range(args.workers)]
+    front = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "api.webhook:app", "--host", args.host, "--port", str(args.port),
+        "--workers", str(args.web_workers), "--no-access-log",
+    ], cwd=ROOT, env=env)
+
+    stopping = False
+
+    def request_stop(_signum, _frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    restarts = [0.0] * args.workers
+    while not stopping:
+        time.sleep(0.5)
+        if front.poll() is not None:
+            logger.error("❌ Front exited with code %s, shutting down", front.returncode)
+            break
+        for index, worker in enumerate(workers):
+            # Не чаще раза в секунду, чтобы падающий на старте воркер не крутился вхолостую
+            if worker.poll() is not None and time.monotonic() - restarts[index] > 1.0:
+                logger.warning("⚠️ Worker %s exited with code %s, restarting", index, worker.returncode)
+                restarts[index] = time.monotonic()
+                workers[index] = spawn_worker(index, args.workers, env)
+
+    # Сначала фронт перестаёт принимать апдейты, потом воркеры дорабатывают то, что уже в streams
+    stop_processes([front], timeout=WORKER_DRAIN_TIMEOUT)
+    stop_processes(workers, timeout=WORKER_DRAIN_TIMEOUT + 5)
+    sys.exit(0 if stopping else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,73 @@
 # utils/logger.py
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import orjson
+
+# Не импортируем config: логгер нужен раньше, чем проверяются обязательные переменные окружения
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" — JSON lines, "text" — прежний формат
+LOG_UPDATE_SAMPLE_RATE = float(os.getenv("LOG_UPDATE_SAMPLE_RATE", 0.01))  # доля апдейтов, логируемых целиком
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra= и попадёт в JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra= добавляются как есть"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Стандартный QueueHandler форматирует сообщение ещё в вызывающем потоке.
+    Здесь запись уходит в очередь как есть — msg % args выполняется уже в потоке QueueListener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _build_handler() -> logging.Handler:
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    return handler
+
 
 # Настройка логгера
 logger = logging.getLogger("zemorent_bot")
-logger.setLevel(logging.INFO)  # Уровень логирования DEBUG для отладки
+logger.setLevel(LOG_LEVEL)
 
-# Чтобы не дублировать хендлеры, если модуль импортируется несколько раз
+# Чтобы не дублировать хендлеры, если модуль импортируется несколько раз.
+# В запросе запись только кладётся в очередь; форматирование и запись в поток — в фоновом потоке.
 if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, _build_handler(), respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(LazyQueueHandler(log_queue))
+    logger.propagate = False
 
 # Отключаем подробный лог httpx, если используется
-logging.getLogger("httpx").setLevel(logging.WARNING)
\ No newline at end of file
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def should_log_update() -> bool:
+    """Сэмплирование полных payload апдейтов: на высоком потоке логируется только их доля"""
+    return logger.isEnabledFor(logging.INFO) and random.random() < LOG_UPDATE_SAMPLE_RATE
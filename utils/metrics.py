@@ -0,0 +1,155 @@
+# utils/metrics.py
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы в секундах: от миллисекунд Redis до многосекундных ожиданий лимитера и повторов
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Монотонный счётчик; значения хранятся по кортежу меток"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+    def merged(self, snapshots) -> dict:
+        """Свои значения плюс снимки других процессов: счётчики складываются"""
+        values = dict(self.values)
+        for snapshot in snapshots:
+            for labels, value in snapshot:
+                labels = tuple(labels)
+                values[labels] = values.get(labels, 0) + value
+        return values
+
+    def samples(self, values: dict | None = None):
+        for labels, value in (self.values if values is None else values).items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами: observe — один bisect и два сложения,
+    поэтому её можно держать включённой на горячем пути.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.series: dict[tuple, list] = {}  # метки -> [счётчики по корзинам (+Inf последней), сумма, количество]
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self) -> list:
+        return [[list(labels), counts, total, count] for labels, (counts, total, count) in self.series.items()]
+
+    def merged(self, snapshots) -> dict:
+        """Свои серии плюс снимки других процессов: корзины, суммы и количества складываются"""
+        series = {labels: [list(counts), total, count] for labels, (counts, total, count) in self.series.items()}
+        for snapshot in snapshots:
+            for labels, counts, total, count in snapshot:
+                labels = tuple(labels)
+                current = series.setdefault(labels, [[0] * len(counts), 0.0, 0])
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+                current[2] += count
+        return series
+
+    def samples(self, series: dict | None = None):
+        for labels, (counts, total, count) in (self.series if series is None else series).items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        """Значения всех метрик процесса для передачи в другой процесс (JSON-совместимо)"""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(self, snapshots=()) -> str:
+        """
+        Текстовый формат экспозиции Prometheus.
+        snapshots — снимки других процессов (например, воркеров): их значения суммируются со своими.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if snapshots:
+                lines.extend(metric.samples(metric.merged(
+                    snapshot[metric.name] for snapshot in snapshots if metric.name in snapshot
+                )))
+            else:
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+update_duration = registry.register(Histogram(
+    "zemo_update_duration_seconds", "Time to process one Telegram update end to end", ("mode",)))
+updates_routed = registry.register(Counter(
+    "zemo_updates_routed_total", "Updates by fast-path route: drop, direct or full dispatch", ("route",)))
+handler_duration = registry.register(Histogram(
+    "zemo_handler_duration_seconds", "Time spent in each registered handler", ("handler",)))
+bot_api_duration = registry.register(Histogram(
+    "zemo_bot_api_duration_seconds", "Outgoing Bot API call latency", ("method",)))
+bot_api_responses = registry.register(Counter(
+    "zemo_bot_api_responses_total", "Outgoing Bot API responses by HTTP status", ("method", "status")))
+redis_duration = registry.register(Histogram(
+    "zemo_redis_command_duration_seconds", "Redis command and pipeline latency", ("command",)))
+rate_limit_wait = registry.register(Histogram(
+    "zemo_rate_limit_wait_seconds", "Time callers waited in RateLimiter.wait_for_slot", ()))
+telegram_retries = registry.register(Counter(
+    "zemo_telegram_retries_total", "Retries made by retry_on_timeout", ("reason",)))
+telegram_flood_waits = registry.register(Counter(
+    "zemo_telegram_429_total", "RetryAfter (429) responses from Telegram", ()))
@@ -1,4 +1,55 @@
-import redis
-from config import REDIS_URL
+from config import REDIS_URL, REDIS_MAX_CONNECTIONS
 
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
\ No newline at end of file
+_client = None
+
+def get_redis():
+    """
+    Клиент создаётся при первом обращении: импорт redis.asyncio и пул не стоят ничего
+    на холодном старте, а соединения открываются только под первую команду.
+    """
+    global _client
+    if _client is None:
+        import redis.asyncio as redis
+        from redis.asyncio.client import Pipeline
+        from utils.metrics import redis_duration
+
+        class InstrumentedPipeline(Pipeline):
+            async def execute(self, *args, **kwargs):
+                with redis_duration.time("PIPELINE"):
+                    return await super().execute(*args, **kwargs)
+
+        class InstrumentedRedis(redis.Redis):
+            """Замер каждой команды и каждого pipeline для /metrics"""
+            async def execute_command(self, *args, **options):
+                with redis_duration.time(str(args[0]).upper()):
+                    return await super().execute_command(*args, **options)
+
+            def pipeline(self, transaction=True, shard_hint=None):
+                return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+        # Общий ограниченный пул: при исчерпании соединений корутины ждут свободное,
+        # а не открывают новые без предела.
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=5,
+            decode_responses=True,
+        )
+        _client = InstrumentedRedis(connection_pool=pool)
+    return _client
+
+
+class _LazyRedis:
+    """Прокси для модулей, импортирующих redis_client: настоящий клиент создаётся при первом вызове"""
+    def __getattr__(self, name):
+        return getattr(get_redis(), name)
+
+
+redis_client = _LazyRedis()
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        await _client.connection_pool.disconnect()
+        _client = None
@@ -0,0 +1,122 @@
+# utils/sent_filter.py
+import hashlib
+import math
+import time
+from config import SENT_FILTER_CAPACITY, SENT_FILTER_ERROR_RATE, SENT_FILTER_WINDOW
+from utils.redis_client import redis_client
+
+# Ключи фильтра — вне пространства zemo:{user_id}, где лежат только хеши профилей.
+# sent:{user_id}:{окно} — битмап, sent:released:{user_id}:{окно} — листинги, доставка которых
+# сорвалась после claim: из Bloom-фильтра их не удалить, поэтому следующий claim видит их здесь
+# и пропускает повторно. Оба ключа живут два окна, так что и released не растёт без предела.
+SENT_PREFIX = "sent:"
+RELEASED_PREFIX = "sent:released:"
+
+# На каждую проверку четыре ключа: битмап текущего и прошлого окна, released текущего и прошлого окна.
+# ARGV: insert (0/1), k, ttl, затем на каждую проверку listing_id и k смещений битов.
+# Возвращает 1 — листинг пользователю ещё не отправляли (и при insert=1 он помечен), 0 — уже отправляли.
+# Дубликаты внутри одной пачки отсекаются тоже: второй экземпляр видит биты первого.
+BLOOM_SCRIPT = """
+local insert = tonumber(ARGV[1]) == 1
+local k = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local result = {}
+local arg = 4
+for i = 1, #KEYS, 4 do
+    local in_current, in_previous = true, true
+    for j = arg + 1, arg + k do
+        local offset = tonumber(ARGV[j])
+        if in_current and redis.call('GETBIT', KEYS[i], offset) == 0 then in_current = false end
+        if in_previous and redis.call('GETBIT', KEYS[i + 1], offset) == 0 then in_previous = false end
+        if not in_current and not in_previous then break end
+    end
+    local seen = in_current or in_previous
+    if seen then
+        for r = i + 2, i + 3 do
+            if redis.call('SISMEMBER', KEYS[r], ARGV[arg]) == 1 then
+                seen = false
+                if insert then redis.call('SREM', KEYS[r], ARGV[arg]) end
+            end
+        end
+    end
+    if not seen and insert then
+        for j = arg + 1, arg + k do
+            redis.call('SETBIT', KEYS[i], tonumber(ARGV[j]), 1)
+        end
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+    result[#result + 1] = seen and 0 or 1
+    arg = arg + k + 1
+end
+return result
+"""
+
+
+class SentListingsFilter:
+    """
+    "Уже отправленные" листинги пользователя: Bloom-фильтр в Redis-битмапе на пользователя и окно времени.
+    Размер фиксирован — capacity листингов за окно с вероятностью ложного "уже отправляли" error_rate,
+    не зависит от числа листингов. Проверяются текущее и прошлое окно, пишется только текущее,
+    поэтому листинг помнится от window до 2 * window секунд, а старые битмапы истекают сами.
+    """
+    def __init__(self, redis, capacity=2000, error_rate=0.001, window=14 * 86400):
+        self.redis = redis
+        self.window = window
+        self.bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.script = None  # регистрируется при первой проверке, не на импорте
+
+    @property
+    def bytes_per_user(self) -> int:
+        """Память на пользователя: два окна по bits бит"""
+        return 2 * math.ceil(self.bits / 8)
+
+    def _offsets(self, listing_id) -> list[int]:
+        # Двойное хеширование: k смещений из двух 64-битных хешей
+        digest = hashlib.blake2b(str(listing_id).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    async def _run(self, pairs, insert: bool) -> list[bool]:
+        if not pairs:
+            return []
+        if self.script is None:
+            self.script = self.redis.register_script(BLOOM_SCRIPT)
+        current = int(time.time() // self.window)
+        keys = []
+        args = [int(insert), self.hashes, 2 * self.window]
+        for user_id, listing_id in pairs:
+            keys += [
+                f"{SENT_PREFIX}{user_id}:{current}", f"{SENT_PREFIX}{user_id}:{current - 1}",
+                f"{RELEASED_PREFIX}{user_id}:{current}", f"{RELEASED_PREFIX}{user_id}:{current - 1}",
+            ]
+            args.append(listing_id)
+            args += self._offsets(listing_id)
+        return [bool(new) for new in await self.script(keys=keys, args=args)]
+
+    async def claim(self, pairs) -> list[bool]:
+        """
+        Атомарно проверяет и помечает пачку пар (user_id, listing_id) одним вызовом.
+        True — отправлять: пара новая и теперь помечена; другие инстансы получат для неё False.
+        """
+        return await self._run(list(pairs), insert=True)
+
+    async def contains(self, pairs) -> list[bool]:
+        """Только проверка пачки, без пометки: True — листинг этому пользователю уже отправляли"""
+        return [not new for new in await self._run(list(pairs), insert=False)]
+
+    async def release(self, user_id: int, listing_id):
+        """
+        Отдаёт пару обратно после временного сбоя доставки: следующий claim её пропустит.
+        Для окончательных ошибок (пользователь заблокировал бота) не вызывать.
+        """
+        key = f"{RELEASED_PREFIX}{user_id}:{int(time.time() // self.window)}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.sadd(key, listing_id)
+            pipe.expire(key, 2 * self.window)
+            await pipe.execute()
+
+sent_filter = SentListingsFilter(
+    redis_client, capacity=SENT_FILTER_CAPACITY, error_rate=SENT_FILTER_ERROR_RATE, window=SENT_FILTER_WINDOW,
+)
@@ -0,0 +1,248 @@
+# utils/settings_store.py
+import asyncio
+import time
+from config import MONGO_URI, MONGO_DB, SETTINGS_FLUSH_INTERVAL, SETTINGS_FLUSH_BATCH
+from utils.logger import logger
+from utils.redis_client import redis_client
+from utils.user_cache import USER_KEY_PREFIX, user_cache
+
+# Пользователи, чьи изменения ещё не дошли до MongoDB: переживает падение процесса.
+# Sorted set, score — время последнего сохранения: живые инстансы сбрасывают свои изменения сами,
+# а восстановление берёт только давно не сброшенные.
+# Служебные ключи — вне пространства zemo:{user_id}, где лежат только хеши профилей.
+DIRTY_KEY = "zemo-store:dirty-at"
+# Флаг "горячий набор в Redis восстановлен из MongoDB"
+WARM_KEY = "zemo-store:warm"
+
+# Восстанавливает профили из MongoDB, не трогая то, что в Redis новее: пропускает существующие ключи
+# и пользователей из DIRTY_KEY (их свежие изменения ещё не дошли до MongoDB).
+# KEYS[1] — DIRTY_KEY, далее ключи профилей; ARGV на каждый ключ: user_id, число полей n, n пар поле/значение.
+RESTORE_SCRIPT = """
+local restored = 0
+local arg = 1
+for i = 2, #KEYS do
+    local user_id = ARGV[arg]
+    local n = tonumber(ARGV[arg + 1])
+    if n > 0 and redis.call('EXISTS', KEYS[i]) == 0 and not redis.call('ZSCORE', KEYS[1], user_id) then
+        redis.call('HSET', KEYS[i], unpack(ARGV, arg + 2, arg + 1 + 2 * n))
+        restored = restored + 1
+    end
+    arg = arg + 2 + 2 * n
+end
+return restored
+"""
+
+# Снимает отметку только с тех, кто не сохранялся после ARGV[1]: свежее изменение другого инстанса
+# ещё лежит в его буфере и должно остаться dirty.
+CLEAN_SCRIPT = """
+local removed = 0
+for i = 2, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) <= tonumber(ARGV[1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+_mongo = None
+
+def get_mongo_collection():
+    """Клиент MongoDB создаётся при первой записи — на пути запроса он не нужен"""
+    global _mongo
+    if _mongo is None:
+        if not MONGO_URI:
+            raise ValueError("MONGO_URI не найден в переменных окружения")
+        from pymongo import AsyncMongoClient
+
+        _mongo = AsyncMongoClient(MONGO_URI)
+    return _mongo[MONGO_DB]["user_settings"]
+
+async def close_mongo():
+    global _mongo
+    if _mongo is not None:
+        await _mongo.close()
+        _mongo = None
+
+
+class SettingsStore:
+    """
+    Write-behind хранение настроек.
+    Redis zemo:{user_id} получает синхронную запись, изменения копятся в буфере (последнее значение
+    на пользователя) и фоновой задачей уходят в MongoDB unordered bulk_write по размеру или по времени.
+    Та же задача после старта и затем раз в recover_after дописывает изменения упавших процессов
+    и прогревает Redis — холодный старт MongoDB не ждёт.
+    """
+    def __init__(self, redis, flush_interval=5.0, max_batch=500, recover_after=60.0):
+        self.redis = redis
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.recover_after = recover_after
+        self.pending: dict[int, dict] = {}
+        self.flush_requested = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        # Регистрируются при первом использовании, не на импорте
+        self.restore_script = None
+        self.clean_script = None
+
+    async def save(self, user_id: int, fields: dict):
+        """Сохраняет настройки: Redis сразу, MongoDB — позже; Mongo latency пользователь не ждёт"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(f"{USER_KEY_PREFIX}{user_id}", mapping=fields)
+            if MONGO_URI:
+                pipe.zadd(DIRTY_KEY, {user_id: time.time()})
+            await pipe.execute()
+        user_cache.remember(user_id, fields)
+        self._buffer(user_id, fields)
+
+    def _buffer(self, user_id: int, fields: dict):
+        if not MONGO_URI:
+            return  # Без MongoDB Redis остаётся единственным хранилищем
+        self.pending.setdefault(user_id, {}).update(fields)
+        if len(self.pending) >= self.max_batch:
+            self.flush_requested.set()
+        self.start()
+
+    async def flush(self) -> int:
+        if not self.pending:
+            return 0
+        from pymongo import UpdateOne
+        from pymongo.errors import PyMongoError
+
+        batch, self.pending = self.pending, {}
+        updated_at = time.time()
+        operations = [
+            UpdateOne({"_id": user_id}, {"$set": {**fields, "updated_at": updated_at}}, upsert=True)
+            for user_id, fields in batch.items()
+        ]
+        try:
+            await get_mongo_collection().bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            # Возвращаем в буфер, не затирая изменения, пришедшие во время записи
+            for user_id, fields in batch.items():
+                self.pending[user_id] = {**fields, **self.pending.get(user_id, {})}
+            logger.warning("⚠️ MongoDB flush of %s users failed, will retry: %r", len(batch), e)
+            return 0
+        # Кто успел сохранить снова, пока шла запись, остаётся dirty до следующего сброса
+        flushed = [user_id for user_id in batch if user_id not in self.pending]
+        if flushed:
+            if self.clean_script is None:
+                self.clean_script = self.redis.register_script(CLEAN_SCRIPT)
+            await self.clean_script(keys=[DIRTY_KEY], args=[updated_at, *flushed])
+        logger.debug("💾 Flushed %s user settings to MongoDB", len(batch))
+        return len(batch)
+
+    async def _recover(self, warm: bool):
+        try:
+            await self.recover_dirty()
+            if warm:
+                await self.warm_redis()
+        except Exception as e:
+            logger.exception("❌ Settings recovery failed: %s", e)
+
+    async def _loop(self):
+        await self._recover(warm=True)
+        recovered_at = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception("❌ Settings flush error: %s", e)
+            if time.monotonic() - recovered_at >= self.recover_after:
+                await self._recover(warm=False)
+                recovered_at = time.monotonic()
+
+    def start(self):
+        """Фоновая запись стартует из lifespan или при первом изменении — в том числе без lifespan (serverless)"""
+        if not MONGO_URI:
+            return
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    async def recover_dirty(self, batch_size=500):
+        """
+        Дописывает в MongoDB изменения, не сброшенные упавшими процессами.
+        Берёт только отметки старше recover_after: свежие ещё в буфере живого инстанса.
+        """
+        cutoff = time.time() - self.recover_after
+        user_ids = [int(member) for member in await self.redis.zrangebyscore(DIRTY_KEY, "-inf", cutoff)]
+        for start in range(0, len(user_ids), batch_size):
+            chunk = user_ids[start:start + batch_size]
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in chunk:
+                    pipe.hgetall(f"{USER_KEY_PREFIX}{user_id}")
+                profiles = await pipe.execute()
+            for user_id, profile in zip(chunk, profiles):
+                if profile:
+                    self.pending.setdefault(user_id, {}).update(profile)
+        if self.pending:
+            logger.info("♻️ Recovered %s unflushed user settings", len(self.pending))
+            await self.flush()
+
+    async def warm_redis(self, batch_size=1000) -> int:
+        """
+        Холодный старт после потери Redis: восстанавливает горячий набор из MongoDB пачками.
+        Вызывается фоновой задачей после recover_dirty. SET NX на флаге гарантирует, что восстановлением занимается
+        один инстанс; повторный прогон безопасен — существующие профили не перезаписываются.
+        """
+        if not await self.redis.set(WARM_KEY, 1, nx=True):
+            return 0
+        restored = 0
+        try:
+            cursor = get_mongo_collection().find({}, batch_size=batch_size)
+            batch = []
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    restored += await self._restore(batch)
+                    batch = []
+            if batch:
+                restored += await self._restore(batch)
+        except Exception:
+            await self.redis.delete(WARM_KEY)  # Другой инстанс попробует снова
+            raise
+        logger.info("🔥 Restored %s user profiles from MongoDB into Redis", restored)
+        return restored
+
+    async def _restore(self, documents: list[dict]) -> int:
+        if self.restore_script is None:
+            self.restore_script = self.redis.register_script(RESTORE_SCRIPT)
+        keys = [DIRTY_KEY]
+        args = []
+        for document in documents:
+            user_id = document.pop("_id")
+            document.pop("updated_at", None)
+            fields = [item for key, value in document.items() if value is not None for item in (key, value)]
+            keys.append(f"{USER_KEY_PREFIX}{user_id}")
+            args += [user_id, len(fields) // 2, *fields]
+        return await self.restore_script(keys=keys, args=args)
+
+    async def load_missing(self, user_ids: list[int]):
+        """
+        Read-through для профилей, вытесненных из Redis: возвращает их из MongoDB в Redis.
+        Вызывается кэшем профилей, когда ключа zemo:{user_id} нет.
+        """
+        try:
+            documents = await get_mongo_collection().find({"_id": {"$in": user_ids}}).to_list(None)
+            if documents:
+                restored = await self._restore(documents)
+                logger.debug("🔥 Restored %s evicted user profiles from MongoDB", restored)
+        except Exception as e:
+            # Без профиля ответим как новому пользователю, но запрос не уроним
+            logger.warning("⚠️ Failed to load profiles %s from MongoDB: %r", user_ids, e)
+
+settings_store = SettingsStore(redis_client, flush_interval=SETTINGS_FLUSH_INTERVAL, max_batch=SETTINGS_FLUSH_BATCH)
+if MONGO_URI:
+    user_cache.loader = settings_store.load_missing
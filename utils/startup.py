@@ -0,0 +1,39 @@
+# utils/startup.py
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from utils.logger import logger
+
+# (фаза, секунды, модули, загруженные за фазу)
+_phases: list[tuple[str, float, list[str]]] = []
+_reported = False
+
+@contextmanager
+def startup_phase(name: str):
+    """Замеряет фазу холодного старта: время и модули, импортированные внутри"""
+    before = set(sys.modules)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - started, sorted(sys.modules.keys() - before)))
+
+def startup_report() -> str:
+    """Отчёт в духе -X importtime, но по фазам старта"""
+    lines = [f"{'phase':<40} | {'ms':>8} | {'modules':>7} | top packages"]
+    for name, elapsed, modules in _phases:
+        packages = Counter(module.split(".")[0] for module in modules).most_common(5)
+        top = ", ".join(f"{package}({count})" for package, count in packages)
+        lines.append(f"{name:<40} | {elapsed * 1000:8.1f} | {len(modules):7d} | {top}")
+    return "\n".join(lines)
+
+def log_startup_report():
+    """Один раз, после первого обработанного апдейта"""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    from config import STARTUP_REPORT
+    if STARTUP_REPORT:
+        logger.info("⏱ Startup report:\n%s", startup_report())
@@ -1,68 +1,462 @@
 # utils/telegram_utils.py
-from telegram.error import TimedOut
+from telegram import TelegramObject
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from redis.exceptions import RedisError
 import asyncio
+import copy
+import math
+import random
 import time
-from collections import defaultdict
+from collections import OrderedDict
+from contextvars import ContextVar
+from config import RATE_LIMIT_BACKEND, REDIS_RATE_LIMIT_TIMEOUT, NOTIFICATION_DISPATCHER
 from utils.logger import logger
+from utils.metrics import bot_api_duration, bot_api_responses, rate_limit_wait, telegram_flood_waits, telegram_retries
+from utils.redis_client import redis_client
+from utils.sent_filter import sent_filter
+
+class TokenBucket:
+    """
+    Token bucket в форме GCRA: хранит только "теоретическое время прибытия" (tat),
+    поэтому проверка и резервирование слота выполняются за O(1) без списков timestamp.
+    """
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.interval = 1.0 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.tat = 0.0
+
+    def earliest(self, now: float) -> float:
+        """Ближайший момент, когда в ведре появится токен"""
+        return max(now, self.tat - self.tolerance)
+
+    def consume(self, at: float):
+        self.tat = max(self.tat, at) + self.interval
+
+    def is_idle(self, now: float) -> bool:
+        """Ведро полностью восстановилось — состояние можно выбросить"""
+        return self.tat <= now
+
+
+class _ChatState:
+    __slots__ = ("buckets", "lock", "waiters")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.lock = asyncio.Lock()  # asyncio.Lock будит ожидающих в порядке FIFO
+        self.waiters = 0
+
 
 class RateLimiter:
-    def __init__(self, messages_per_second=1, global_messages_per_second=30):
-        self.chat_timestamps = defaultdict(list)
-        self.global_timestamps = []
+    """
+    Per-chat и глобальные token bucket'ы.
+    Каждый вызывающий резервирует свой слот и спит ровно до него, без циклов опроса.
+    Состояние простаивающих чатов удаляется, поэтому память ограничена активными чатами.
+    """
+    def __init__(self, messages_per_second=1, global_messages_per_second=30, group_messages_per_minute=20):
         self.messages_per_second = messages_per_second
         self.global_messages_per_second = global_messages_per_second
+        self.group_messages_per_minute = group_messages_per_minute
+        self.global_bucket = TokenBucket(global_messages_per_second, capacity=global_messages_per_second)
+        self.chats: OrderedDict[int, _ChatState] = OrderedDict()  # от давно использованных к недавним
+
+    def _new_chat_state(self, chat_id: int) -> _ChatState:
+        buckets = (TokenBucket(self.messages_per_second),)
+        if chat_id < 0:
+            # Группы и каналы: дополнительно не больше 20 сообщений в минуту
+            buckets += (TokenBucket(self.group_messages_per_minute / 60, capacity=self.group_messages_per_minute),)
+        return _ChatState(buckets)
+
+    def _get_chat_state(self, chat_id: int) -> _ChatState:
+        state = self.chats.get(chat_id)
+        if state is None:
+            state = self.chats[chat_id] = self._new_chat_state(chat_id)
+        else:
+            self.chats.move_to_end(chat_id)
+        return state
+
+    def _evict_idle(self, now: float):
+        # Самые старые состояния в начале; останавливаемся на первом активном
+        while self.chats:
+            state = next(iter(self.chats.values()))
+            if state.waiters or not all(bucket.is_idle(now) for bucket in state.buckets):
+                break
+            self.chats.popitem(last=False)
+
+    async def _wait_local(self, state: _ChatState):
+        # Ждём слот чата под его lock, чтобы сообщения одного чата шли по очереди
+        now = time.monotonic()
+        chat_at = max(bucket.earliest(now) for bucket in state.buckets)
+        if chat_at > now:
+            await asyncio.sleep(chat_at - now)
+            now = time.monotonic()
+
+        # Глобальный слот резервируем только теперь, чтобы не держать его впустую
+        send_at = self.global_bucket.earliest(now)
+        self.global_bucket.consume(send_at)
+        for bucket in state.buckets:
+            bucket.consume(send_at)
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def _wait(self, chat_id, state: _ChatState):
+        await self._wait_local(state)
 
     async def wait_for_slot(self, chat_id):
-        current_time = time.time()
-        # Clean old timestamps
-        self.chat_timestamps[chat_id] = [t for t in self.chat_timestamps[chat_id] if current_time - t < 1]
-        self.global_timestamps = [t for t in self.global_timestamps if current_time - t < 1]
-        
-        # Wait for chat-specific slot
-        while len(self.chat_timestamps[chat_id]) >= self.messages_per_second:
-            await asyncio.sleep(0.1)
-            current_time = time.time()
-            self.chat_timestamps[chat_id] = [t for t in self.chat_timestamps[chat_id] if current_time - t < 1]
-        
-        # Wait for global slot
-        while len(self.global_timestamps) >= self.global_messages_per_second:
-            await asyncio.sleep(0.1)
-            current_time = time.time()
-            self.global_timestamps = [t for t in self.global_timestamps if current_time - t < 1]
-        
-        # Record timestamps
-        self.chat_timestamps[chat_id].append(current_time)
-        self.global_timestamps.append(current_time)
+        started = time.monotonic()
+        state = self._get_chat_state(chat_id)
+        state.waiters += 1
+        try:
+            async with state.lock:
+                await self._wait(chat_id, state)
+        finally:
+            state.waiters -= 1
+            now = time.monotonic()
+            rate_limit_wait.observe(now - started)
+            self._evict_idle(now)
+
+
+# Атомарная проверка per-chat и глобального лимита для всего флота инстансов.
+# KEYS[1] — глобальное ведро, KEYS[2..] — ведра чата; ARGV — пары (interval_ms, tolerance_ms).
+# Возвращает {1, delay_ms}, если слот зарезервирован, или {0, delay_ms}, если чат ещё занят.
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local tats = {}
+for i = 1, #KEYS do
+    tats[i] = tonumber(redis.call('GET', KEYS[i]) or 0)
+end
+local chat_at = now
+for i = 2, #KEYS do
+    chat_at = math.max(chat_at, tats[i] - tonumber(ARGV[2 * i]))
+end
+if chat_at > now then
+    return {0, chat_at - now}
+end
+local send_at = math.max(now, tats[1] - tonumber(ARGV[2]))
+for i = 1, #KEYS do
+    local tat = math.max(tats[i], send_at) + tonumber(ARGV[2 * i - 1])
+    redis.call('SET', KEYS[i], tat, 'PX', tat - now + 1000)
+end
+return {1, send_at - now}
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Распределённый лимитер: один вызов Lua-скрипта на проверку, бюджет общий для всех инстансов.
+    Если Redis отвечает медленно или с ошибкой, на fallback_cooldown секунд переключаемся на локальные ведра.
+    """
+    def __init__(self, redis, timeout=0.05, fallback_cooldown=30, **kwargs):
+        super().__init__(**kwargs)
+        self.redis = redis
+        self.timeout = timeout
+        self.fallback_cooldown = fallback_cooldown
+        self.fallback_until = 0.0
+        self.script = None  # регистрируется при первой проверке, не на импорте
+
+    def _script_args(self, chat_id) -> tuple[list, list]:
+        keys = ["ratelimit:global", f"ratelimit:chat:{chat_id}"]
+        buckets = [self.global_bucket, *self._new_chat_state(chat_id).buckets]
+        if len(buckets) > 2:
+            keys.append(f"ratelimit:group:{chat_id}")
+        args = []
+        for bucket in buckets:
+            # Целые миллисекунды: интервал округляем вверх, допуск вниз — только в безопасную сторону
+            args += [math.ceil(bucket.interval * 1000), math.floor(bucket.tolerance * 1000)]
+        return keys, args
+
+    async def _wait(self, chat_id, state: _ChatState):
+        if time.monotonic() < self.fallback_until:
+            return await self._wait_local(state)
+
+        if self.script is None:
+            self.script = self.redis.register_script(GCRA_SCRIPT)
+        keys, args = self._script_args(chat_id)
+        while True:
+            try:
+                reserved, delay_ms = await asyncio.wait_for(self.script(keys=keys, args=args), self.timeout)
+            except (RedisError, asyncio.TimeoutError) as e:
+                logger.warning("⚠️ Redis rate limiter unavailable (%r), falling back to local limiter for %ss", e, self.fallback_cooldown)
+                self.fallback_until = time.monotonic() + self.fallback_cooldown
+                return await self._wait_local(state)
+            if delay_ms > 0:
+                await asyncio.sleep(delay_ms / 1000)
+            if reserved:
+                return
 
 # Initialize rate limiter
-rate_limiter = RateLimiter()
+if RATE_LIMIT_BACKEND == "redis":
+    rate_limiter = RedisRateLimiter(redis_client, timeout=REDIS_RATE_LIMIT_TIMEOUT)
+else:
+    rate_limiter = RateLimiter()
+
+class CircuitOpenError(TelegramError):
+    """Telegram API считается деградировавшим — вызов отклонён без сетевого запроса"""
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold сетевых ошибок подряд размыкается на recovery_timeout секунд,
+    затем пропускает один пробный вызов (half-open): успех замыкает цепь, ошибка — снова размыкает.
+    """
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
 
-async def retry_on_timeout(func, max_attempts=3, delay=1, chat_id=None, message_text=None):
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def release_probe(self):
+        """Пробный вызов завершился без ответа о состоянии Telegram"""
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                logger.warning("🔌 Telegram circuit opened after %s failures", self.failures)
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class RetryPolicy:
+    """
+    Настройки повторов для конкретного места вызова.
+
+    Args:
+        max_attempts: Максимальное число попыток.
+        base_delay: База экспоненциальной задержки (секунды).
+        max_delay: Потолок задержки между попытками.
+        max_retry_after: Дольше этого RetryAfter не ждём внутри запроса.
+        breaker: CircuitBreaker или None, чтобы не использовать.
+        durable: Отдавать неудавшуюся отправку в постоянную очередь вместо исключения (только с NOTIFICATION_DISPATCHER)
+            (нужен payload у retry_on_timeout).
+        interactive: В какую полосу очереди ставить отложенную отправку.
+    """
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=30.0, max_retry_after=30.0,
+                 breaker: CircuitBreaker | None = None, durable=False, interactive=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker
+        self.durable = durable
+        self.interactive = interactive
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: случайная задержка в [0, base * 2^attempt], чтобы корутины не повторяли в такт"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+# Один breaker на процесс: все места вызова видят деградацию Telegram одинаково
+telegram_breaker = CircuitBreaker()
+DEFAULT_RETRY_POLICY = RetryPolicy(breaker=telegram_breaker)
+DURABLE_RETRY_POLICY = RetryPolicy(max_attempts=2, max_retry_after=5.0, breaker=telegram_breaker, durable=True)
+
+async def _defer_to_retry_queue(payload: dict, policy: RetryPolicy, reason, listing_id=None) -> bool:
+    if not NOTIFICATION_DISPATCHER:
+        return False  # Очередь никто не разбирает — пусть вызывающий узнает об ошибке
+    # Ленивый импорт: dispatcher сам зависит от этого модуля
+    from monitoring.dispatcher import enqueue_notification
+    params = dict(payload)
+    chat_id = params.pop("chat_id")
+    if listing_id is not None:
+        await _release_listing(chat_id, listing_id)  # Иначе отложенная отправка сочтёт листинг доставленным
+    try:
+        await enqueue_notification(redis_client, chat_id, params, interactive=policy.interactive, listing_id=listing_id)
+    except RedisError as e:
+        logger.error("❌ Failed to queue retry for chat_id=%s: %r", chat_id, e)
+        return False
+    logger.warning("📥 Queued send to chat_id=%s for durable retry: %s", chat_id, reason)
+    return True
+
+async def _claim_listing(chat_id, listing_id) -> bool:
+    try:
+        return (await sent_filter.claim([(chat_id, listing_id)]))[0]
+    except RedisError as e:
+        # Лучше возможный дубль, чем потерянное уведомление
+        logger.warning("⚠️ Sent-listings filter unavailable for chat_id=%s: %r", chat_id, e)
+        return True
+
+async def _release_listing(chat_id, listing_id):
+    try:
+        await sent_filter.release(chat_id, listing_id)
+    except RedisError as e:
+        logger.warning("⚠️ Failed to release listing %s for chat_id=%s: %r", listing_id, chat_id, e)
+
+async def retry_on_timeout(func, max_attempts=None, delay=None, chat_id=None, message_text=None,
+                           policy: RetryPolicy | None = None, payload: dict | None = None, listing_id=None):
     """
-    Retries a Telegram API call on TimedOut errors with exponential backoff.
-    
+    Retries a Telegram API call on network errors and 429 responses.
+
+    RetryAfter waits exactly the time Telegram asked for, other network errors use full-jitter
+    exponential backoff, and an open circuit breaker fails fast without calling Telegram.
+
     Args:
         func: The async function to execute (e.g., send_message).
-        max_attempts: Maximum number of retry attempts.
-        delay: Initial delay between retries (seconds).
+        max_attempts: Overrides policy.max_attempts.
+        delay: Overrides policy.base_delay (seconds).
         chat_id: Chat ID for rate limiting and logging.
         message_text: Text of the message for logging.
-    
+        policy: RetryPolicy for this call site (DEFAULT_RETRY_POLICY by default).
+        payload: send_message kwargs (with chat_id) for the durable retry queue.
+        listing_id: Listing being notified about; a listing already sent to chat_id is skipped
+            before rate limiting, and a transiently failed send is released so that a retry can deliver it.
+
     Returns:
-        Result of the function if successful.
-    
+        Result of the function if successful, None if the send was queued for durable retry
+        or the listing was already sent to this chat.
+
     Raises:
-        TimedOut: If all retries fail.
+        TimedOut, NetworkError, RetryAfter: If all retries fail.
+        CircuitOpenError: If the circuit breaker is open.
     """
-    for attempt in range(max_attempts):
+    policy = policy or DEFAULT_RETRY_POLICY
+    if max_attempts is not None or delay is not None:
+        policy = copy.copy(policy)
+        policy.max_attempts = max_attempts if max_attempts is not None else policy.max_attempts
+        policy.base_delay = delay if delay is not None else policy.base_delay
+
+    if listing_id is None or not chat_id:
+        return await _send_with_retries(func, policy, chat_id, message_text, payload)
+    if not await _claim_listing(chat_id, listing_id):
+        logger.debug("🔁 Listing %s already sent to chat_id=%s, skipping", listing_id, chat_id)
+        return None
+    try:
+        return await _send_with_retries(func, policy, chat_id, message_text, payload, listing_id)
+    except (Forbidden, BadRequest):
+        raise  # Повтор не состоится — отметка "отправлено" остаётся, released не растёт
+    except BaseException:
+        await _release_listing(chat_id, listing_id)
+        raise
+
+async def _send_with_retries(func, policy: RetryPolicy, chat_id, message_text, payload, listing_id=None):
+    breaker = policy.breaker
+
+    for attempt in range(policy.max_attempts):
+        last_attempt = attempt == policy.max_attempts - 1
+        if breaker and not breaker.allow():
+            error = CircuitOpenError("Telegram API circuit is open")
+            if policy.durable and payload and await _defer_to_retry_queue(payload, policy, error, listing_id):
+                return None
+            raise error
+        # Вызов, получивший пробный слот half-open, обязан вернуть вердикт или освободить слот
+        probe = bool(breaker and breaker.probing)
         try:
             if chat_id:
                 await rate_limiter.wait_for_slot(chat_id)
-            return await func()
-        except TimedOut as e:
-            if attempt == max_attempts - 1:
-                logger.error(f"❌ Failed to send to chat_id={chat_id} after {max_attempts} attempts: {e}, message={message_text}")
+            result = await func()
+            if breaker:
+                breaker.record_success()
+            return result
+        except RetryAfter as e:
+            telegram_flood_waits.inc()
+            if breaker:
+                breaker.record_success()  # 429 — Telegram отвечает, деградации нет
+            wait = retry_after_seconds(e)
+            if last_attempt or wait > policy.max_retry_after:
+                if policy.durable and payload and await _defer_to_retry_queue(payload, policy, e, listing_id):
+                    return None
+                logger.error("❌ Telegram flood control for chat_id=%s: retry after %ss, message=%s", chat_id, wait, message_text)
                 raise
-            logger.warning(f"⚠️ Telegram TimedOut for chat_id={chat_id}, retrying in {delay}s (attempt {attempt + 1}/{max_attempts}), message={message_text}")
-            await asyncio.sleep(delay)
-            delay *= 2  # Exponential backoff
\ No newline at end of file
+            telegram_retries.inc("RetryAfter")
+            logger.warning("⚠️ Telegram RetryAfter for chat_id=%s, waiting %ss (attempt %s/%s), message=%s", chat_id, wait, attempt + 1, policy.max_attempts, message_text)
+            await asyncio.sleep(wait)
+        except NetworkError as e:
+            if isinstance(e, BadRequest):
+                if breaker:
+                    breaker.record_success()
+                raise  # Ошибка запроса, повтор не поможет
+            if breaker:
+                breaker.record_failure()
+            if last_attempt:
+                if policy.durable and payload and await _defer_to_retry_queue(payload, policy, e, listing_id):
+                    return None
+                logger.error("❌ Failed to send to chat_id=%s after %s attempts: %s, message=%s", chat_id, policy.max_attempts, e, message_text)
+                raise
+            backoff = policy.backoff(attempt)
+            telegram_retries.inc(type(e).__name__)
+            logger.warning("⚠️ Telegram %s for chat_id=%s, retrying in %.2fs (attempt %s/%s), message=%s", type(e).__name__, chat_id, backoff, attempt + 1, policy.max_attempts, message_text)
+            await asyncio.sleep(backoff)
+        except TelegramError:
+            if breaker:
+                breaker.record_success()
+            raise
+        except BaseException:
+            # В том числе отмена (CancelledError): иначе probing останется True и цепь не замкнётся никогда
+            if probe and breaker.probing:
+                breaker.release_probe()
+            raise
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий каждый исходящий вызов Bot API и считающий ответы по HTTP-статусу"""
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        status = "error"
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            return status, payload
+        finally:
+            bot_api_duration.observe(time.perf_counter() - started, api_method)
+            bot_api_responses.inc(api_method, status)
+
+
+class WebhookReply:
+    """Один вызов Bot API, который уйдёт в теле ответа на webhook вместо отдельного HTTPS-запроса"""
+    __slots__ = ("payload",)
+
+    def __init__(self):
+        self.payload: dict | None = None
+
+# Устанавливается эндпоинтом на время обработки апдейта в reply-in-response режиме
+webhook_reply: ContextVar[WebhookReply | None] = ContextVar("webhook_reply", default=None)
+
+def defer_to_webhook_response(method: str, **params) -> bool:
+    """
+    Пытается отправить вызов method в ответе на webhook.
+    Использовать только для последнего исходящего вызова хендлера: он выполнится уже после
+    завершения обработки апдейта, а его результат Telegram не возвращает.
+
+    Returns:
+        True, если вызов отложен в ответ; False — отправьте его как обычно.
+    """
+    reply = webhook_reply.get()
+    if reply is None or reply.payload is not None:
+        return False
+    payload = {"method": method}
+    for key, value in params.items():
+        if value is not None:
+            payload[key] = value.to_dict() if isinstance(value, TelegramObject) else value
+    reply.payload = payload
+    return True
@@ -0,0 +1,146 @@
+# utils/update_queue.py
+import asyncio
+from typing import Awaitable, Callable
+from utils.logger import logger
+
+# Ключи апдейта, в которых лежит объект с chat
+CHAT_CONTAINERS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request", "business_message",
+)
+
+def extract_chat_id(update_json: dict) -> int | None:
+    """Достаём chat_id из сырого JSON апдейта без построения объектов PTB"""
+    for key in CHAT_CONTAINERS:
+        container = update_json.get(key)
+        if container:
+            chat = container.get("chat")
+            if chat:
+                return chat.get("id")
+    callback_query = update_json.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message") or {}
+        chat = message.get("chat") or callback_query.get("from") or {}
+        return chat.get("id")
+    for key in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query"):
+        container = update_json.get(key)
+        if container:
+            return (container.get("from") or {}).get("id")
+    return None
+
+def extract_user_id(update_json: dict) -> int | None:
+    """Автор апдейта (поле from) — для учёта активности пользователя"""
+    for key, container in update_json.items():
+        if isinstance(container, dict):
+            user = container.get("from")
+            if user:
+                return user.get("id")
+    return None
+
+
+class UpdateDeduplicator:
+    """
+    Отбрасывает повторные доставки одного update_id.
+    SET NX с TTL: ключ живёт дольше окна повторных отправок Telegram.
+    """
+    def __init__(self, redis, ttl=3600, prefix="update:"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def is_new(self, update_id: int) -> bool:
+        from redis.exceptions import RedisError
+
+        try:
+            return bool(await self.redis.set(f"{self.prefix}{update_id}", 1, nx=True, ex=self.ttl))
+        except RedisError as e:
+            # Лучше обработать апдейт повторно, чем потерять его
+            logger.warning("⚠️ Update dedup unavailable for update_id=%s: %r", update_id, e)
+            return True
+
+    async def forget(self, update_id: int):
+        """Снимает отметку, чтобы повторная доставка не считалась дубликатом"""
+        from redis.exceptions import RedisError
+
+        try:
+            await self.redis.delete(f"{self.prefix}{update_id}")
+        except RedisError as e:
+            logger.warning("⚠️ Failed to reset dedup for update_id=%s: %r", update_id, e)
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь апдейтов, обрабатываемых в фоне не более чем по workers одновременно.
+    Апдейты одного чата выстраиваются в цепочку и идут строго по порядку, а разные чаты
+    не ждут друг друга: чат, выжидающий RetryAfter или медленный хендлер, держит только свою цепочку.
+    """
+    def __init__(self, handler: Callable[[dict], Awaitable], workers=8, maxsize=1000, put_timeout=5.0):
+        self.handler = handler
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.capacity = asyncio.Semaphore(maxsize)  # принятые, но ещё не обработанные апдейты
+        self.slots = asyncio.Semaphore(workers)  # одновременно работающие хендлеры
+        self.tails: dict = {}  # чат -> последняя задача его цепочки
+        self.active: set[asyncio.Task] = set()
+        self.running = False
+
+    @property
+    def started(self) -> bool:
+        return self.running
+
+    def qsize(self) -> int:
+        return len(self.active)
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            logger.info("🧵 Started update queue: %s concurrent handlers", self.workers)
+
+    async def put(self, update_json: dict) -> bool:
+        """
+        Ставит апдейт в цепочку его чата.
+        Если очередь полна дольше put_timeout, возвращает False — вызывающий отвечает ошибкой,
+        и Telegram доставит апдейт позже (backpressure вместо роста памяти).
+        """
+        key = extract_chat_id(update_json)
+        if key is None:
+            key = ("update", update_json.get("update_id"))
+        try:
+            await asyncio.wait_for(self.capacity.acquire(), self.put_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Update queue full, rejecting update_id=%s", update_json.get('update_id'))
+            return False
+        task = asyncio.create_task(self._handle(self.tails.get(key), update_json))
+        self.tails[key] = task
+        self.active.add(task)
+        task.add_done_callback(lambda done, key=key: self._done(key, done))
+        return True
+
+    async def _handle(self, previous: asyncio.Task | None, update_json: dict):
+        if previous is not None:
+            await asyncio.wait((previous,))
+        async with self.slots:
+            try:
+                await self.handler(update_json)
+            except Exception as e:
+                logger.exception("❌ Error processing update_id=%s: %s", update_json.get('update_id'), e)
+
+    def _done(self, key, task: asyncio.Task):
+        self.active.discard(task)
+        if self.tails.get(key) is task:
+            del self.tails[key]
+        self.capacity.release()
+
+    async def stop(self, drain_timeout=10.0):
+        """Дожидается обработки уже принятых апдейтов и отменяет то, что не успело"""
+        if not self.running:
+            return
+        self.running = False
+        if not self.active:
+            return
+        _, pending = await asyncio.wait(set(self.active), timeout=drain_timeout)
+        if pending:
+            logger.warning("⚠️ Update queue not drained in %ss, %s updates dropped", drain_timeout, len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,247 @@
+# utils/update_stream.py
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+import orjson
+from utils.logger import logger
+from utils.metrics import registry
+from utils.update_queue import extract_chat_id
+
+STREAM_PREFIX = "updates:"
+GROUP = "update-workers"
+# Хеши consumer -> JSON: heartbeat-ы и снимки метрик воркеров, без SCAN по всему keyspace
+HEALTH_KEY = "workers:health"
+METRICS_KEY = "workers:metrics"
+
+def shard_for(update_json: dict, shards: int) -> int:
+    """Шард апдейта по chat_id: стабилен между процессами, в отличие от hash() строк"""
+    key = extract_chat_id(update_json)
+    if key is None:
+        key = update_json.get("update_id", 0)
+    return key % shards
+
+def owned_shards(index: int, count: int, shards: int) -> list[int]:
+    """Шарды воркера index из count: у каждого шарда ровно один владелец"""
+    return [shard for shard in range(shards) if shard % count == index]
+
+async def publish_update(redis, update_json: dict, body: bytes, shards: int, maxlen=100_000):
+    """Кладёт сырой апдейт в stream его шарда — воркер разберёт JSON сам"""
+    stream = f"{STREAM_PREFIX}{shard_for(update_json, shards)}"
+    await redis.xadd(stream, {"update": body}, maxlen=maxlen, approximate=True)
+
+async def worker_health(redis) -> list[dict]:
+    """Последние heartbeat-ы живых воркеров; просроченные записи умерших удаляются"""
+    now = time.time()
+    reports, stale = [], []
+    for consumer, raw in (await redis.hgetall(HEALTH_KEY)).items():
+        report = orjson.loads(raw)
+        (reports if report["expires_at"] > now else stale).append(report)
+    if stale:
+        await redis.hdel(HEALTH_KEY, *(report["consumer"] for report in stale))
+    return sorted(reports, key=lambda report: report["consumer"])
+
+async def worker_metrics(redis) -> list[dict]:
+    """Снимки метрик воркеров для Registry.render на фронте"""
+    return [orjson.loads(raw) for raw in (await redis.hgetall(METRICS_KEY)).values()]
+
+
+class UpdateStreamWorker:
+    """
+    Обрабатывает апдейты своих шардов из Redis streams.
+    Все шарды читаются одним XREADGROUP (одно соединение на процесс). Апдейты одного чата выстраиваются
+    в цепочку и идут строго по порядку, разные чаты — параллельно, не дожидаясь друг друга; в обработке
+    не больше max_in_flight апдейтов. Апдейт подтверждается после обработки, поэтому неподтверждённое
+    после падения перечитывается при перезапуске воркера с тем же именем потребителя, а зависшее
+    дольше claim_idle_ms у других потребителей (например, воркеров стало меньше) забирается XAUTOCLAIM.
+    """
+    def __init__(self, redis, handler: Callable[[dict], Awaitable], shards: list[int], consumer: str,
+                 batch_size=100, max_in_flight=256, block_ms=1000, health_interval=5.0, claim_idle_ms=60_000):
+        self.redis = redis
+        self.handler = handler
+        self.streams = [f"{STREAM_PREFIX}{shard}" for shard in shards]
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.block_ms = block_ms
+        self.health_interval = health_interval
+        self.claim_idle_ms = claim_idle_ms
+        self.stopping = asyncio.Event()
+        self.room = asyncio.Event()
+        self.tails: dict = {}  # чат -> последняя задача его цепочки
+        self.active: set[asyncio.Task] = set()
+        self.local_ids: set[str] = set()  # прочитанные и ещё не обработанные — повторно не забираем
+        self.task: asyncio.Task | None = None
+        self.reporter: asyncio.Task | None = None
+        self.processed = 0
+        self.failed = 0
+        self.started_at = time.time()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.active)
+
+    async def _ensure_groups(self):
+        from redis.exceptions import ResponseError
+
+        for stream in self.streams:
+            try:
+                await self.redis.xgroup_create(stream, GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def _handle(self, previous: asyncio.Task | None, stream: str, entry_id: str, update_json: dict):
+        if previous is not None:
+            await asyncio.wait((previous,))
+        try:
+            await self.handler(update_json)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.exception("❌ Error processing update_id=%s: %s", update_json.get("update_id"), e)
+        try:
+            await self.redis.xack(stream, GROUP, entry_id)
+        except Exception as e:
+            logger.warning("⚠️ Failed to ack update_id=%s: %r", update_json.get("update_id"), e)
+
+    def _done(self, key, entry_id: str, task: asyncio.Task):
+        self.active.discard(task)
+        self.local_ids.discard(entry_id)
+        if self.tails.get(key) is task:
+            del self.tails[key]
+        self.room.set()
+
+    def _schedule(self, response):
+        for stream, entries in response:
+            for entry_id, fields in entries:
+                update_json = orjson.loads(fields["update"])
+                key = extract_chat_id(update_json)
+                if key is None:
+                    key = ("update", update_json.get("update_id"))
+                task = asyncio.create_task(self._handle(self.tails.get(key), stream, entry_id, update_json))
+                self.tails[key] = task
+                self.active.add(task)
+                self.local_ids.add(entry_id)
+                task.add_done_callback(lambda done, key=key, entry_id=entry_id: self._done(key, entry_id, done))
+
+    async def _wait_room(self):
+        while self.in_flight >= self.max_in_flight:
+            self.room.clear()
+            await self.room.wait()
+
+    async def _read(self, ids: dict, block=None):
+        await self._wait_room()
+        count = min(self.batch_size, self.max_in_flight - self.in_flight)
+        try:
+            return await self.redis.xreadgroup(GROUP, self.consumer, ids, count=count, block=block) or []
+        except Exception as e:
+            logger.warning("⚠️ Failed to read update streams: %r", e)
+            await asyncio.sleep(1)
+            return []
+
+    async def _claim_stale(self):
+        """Забирает апдейты своих шардов, зависшие у других потребителей дольше claim_idle_ms"""
+        try:
+            for stream in self.streams:
+                start = "0-0"
+                while not self.stopping.is_set():
+                    await self._wait_room()
+                    start, entries, _ = await self.redis.xautoclaim(
+                        stream, GROUP, self.consumer, self.claim_idle_ms, start_id=start, count=self.batch_size,
+                    )
+                    # Удалённые обрезкой stream записи обработать нельзя — только подтвердить
+                    trimmed = [entry_id for entry_id, fields in entries if not fields]
+                    if trimmed:
+                        await self.redis.xack(stream, GROUP, *trimmed)
+                    self._schedule([(stream, [
+                        (entry_id, fields) for entry_id, fields in entries
+                        if fields and entry_id not in self.local_ids
+                    ])])
+                    if start in ("0-0", b"0-0") or not entries:
+                        break
+        except Exception as e:
+            logger.warning("⚠️ Failed to claim stale updates: %r", e)
+
+    async def _consume(self):
+        # Сначала свои неподтверждённые апдейты с прошлого запуска
+        pending = {stream: "0" for stream in self.streams}
+        while pending and not self.stopping.is_set():
+            response = await self._read(pending)
+            returned = dict(response)
+            for stream in list(pending):
+                if returned.get(stream):
+                    pending[stream] = returned[stream][-1][0]
+                else:
+                    del pending[stream]
+            self._schedule(response)
+
+        new = {stream: ">" for stream in self.streams}
+        claimed_at = None  # первый проход — сразу после своих pending
+        while not self.stopping.is_set():
+            if claimed_at is None or time.monotonic() - claimed_at >= self.claim_idle_ms / 1000:
+                await self._claim_stale()
+                claimed_at = time.monotonic()
+            self._schedule(await self._read(new, block=self.block_ms))
+
+    async def report_health(self):
+        """Heartbeat и снимок метрик процесса: фронт отдаёт их в /health/workers и /metrics"""
+        now = time.time()
+        report = {
+            "consumer": self.consumer,
+            "pid": os.getpid(),
+            "shards": len(self.streams),
+            "processed": self.processed,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "started_at": round(self.started_at, 3),
+            "heartbeat": round(now, 3),
+            "expires_at": round(now + self.health_interval * 3, 3),
+            "state": "draining" if self.stopping.is_set() else "running",
+        }
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(HEALTH_KEY, self.consumer, orjson.dumps(report))
+            pipe.hset(METRICS_KEY, self.consumer, orjson.dumps(registry.snapshot()))
+            await pipe.execute()
+
+    async def _reporter(self):
+        while True:
+            try:
+                await self.report_health()
+            except Exception as e:
+                logger.warning("⚠️ Failed to report worker health: %r", e)
+            await asyncio.sleep(self.health_interval)
+
+    async def start(self):
+        await self._ensure_groups()
+        self.started_at = time.time()
+        self.task = asyncio.create_task(self._consume())
+        self.reporter = asyncio.create_task(self._reporter())
+        logger.info("🧵 Update worker %s started: %s shards", self.consumer, len(self.streams))
+
+    async def stop(self, drain_timeout=10.0):
+        """Перестаёт читать новые апдейты и дожидается обработки и подтверждения уже прочитанных"""
+        self.stopping.set()
+        self.room.set()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.active:
+            _, pending = await asyncio.wait(set(self.active), timeout=drain_timeout)
+            if pending:
+                # Неподтверждённое перечитается при следующем запуске
+                logger.warning("⚠️ Update worker %s not drained in %ss, %s updates left pending", self.consumer, drain_timeout, len(pending))
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self.reporter is not None:
+            self.reporter.cancel()
+            await asyncio.gather(self.reporter, return_exceptions=True)
+            self.reporter = None
+        try:
+            # Метрики остаются: перезапущенный воркер с тем же именем перезапишет их
+            await self.report_health()
+            await self.redis.hdel(HEALTH_KEY, self.consumer)
+        except Exception:
+            pass
+        logger.info("🛑 Update worker %s stopped: processed=%s, failed=%s", self.consumer, self.processed, self.failed)
@@ -0,0 +1,164 @@
+# utils/user_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_CONFIGURE_NOTIFICATIONS
+from utils.logger import logger
+from utils.redis_client import redis_client
+
+USER_KEY_PREFIX = "zemo:"
+NOTIFY_FLAGS = "Kghx"  # keyspace-события hash, generic и expired — минимум для инвалидации
+
+
+class UserProfileCache:
+    """
+    In-process LRU-кэш полей hash zemo:{user_id} с коротким TTL.
+    Из Redis читаются только запрошенные поля (HMGET), отсутствующие тоже кэшируются.
+    Записи через hset() обновляют кэш сразу, записи других инстансов приходят
+    через keyspace notifications и сбрасывают запись.
+    Если ключа в Redis нет, loader (при наличии) может вернуть его из постоянного хранилища.
+    """
+    def __init__(self, redis, maxsize=10_000, ttl=30.0):
+        self.redis = redis
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()  # user_id -> (expires_at, поля)
+        self.listener: asyncio.Task | None = None
+        # async loader(user_ids): восстанавливает в Redis профили, ключей которых там нет
+        self.loader: Callable[[list[int]], Awaitable] | None = None
+
+    def _cached(self, user_id: int, now: float) -> dict | None:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, fields = entry
+        if expires_at <= now:
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return fields
+
+    def _store(self, user_id: int, fields: dict, now: float):
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[0] > now:
+            # Дополняем, не продлевая TTL, чтобы старые поля не жили вечно
+            entry[1].update(fields)
+            self.entries.move_to_end(user_id)
+            return
+        self.entries[user_id] = (now + self.ttl, dict(fields))
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    @staticmethod
+    def _present(fields: dict, names: tuple) -> dict:
+        # None в кэше означает "поля нет в Redis"
+        return {name: fields[name] for name in names if fields.get(name) is not None}
+
+    async def get(self, user_id: int, fields: tuple[str, ...]) -> dict:
+        """Возвращает только существующие поля из fields"""
+        return (await self.get_many([user_id], fields))[0]
+
+    async def get_many(self, user_ids: list[int], fields: tuple[str, ...]) -> list[dict]:
+        """Несколько пользователей: всё, чего нет в кэше, читается одним pipeline"""
+        now = time.monotonic()
+        missing: list[tuple[int, tuple]] = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._cached(user_id, now)
+            absent = tuple(name for name in fields if cached is None or name not in cached)
+            if absent:
+                missing.append((user_id, absent))
+
+        if missing:
+            results = await self._read(missing)
+            if self.loader is not None:
+                evicted = [(user_id, absent) for (user_id, absent), exists, _ in results if not exists]
+                if evicted:
+                    await self.loader([user_id for user_id, _ in evicted])
+                    results = [*(result for result in results if result[1]), *await self._read(evicted)]
+            for (user_id, absent), _, values in results:
+                self._store(user_id, dict(zip(absent, values)), now)
+
+        return [self._present(self._cached(user_id, now) or {}, fields) for user_id in user_ids]
+
+    async def _read(self, missing: list[tuple[int, tuple]]) -> list[tuple[tuple[int, tuple], bool, list]]:
+        """HMGET запрошенных полей одним pipeline; EXISTS — только когда есть loader"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, absent in missing:
+                key = f"{USER_KEY_PREFIX}{user_id}"
+                pipe.hmget(key, absent)
+                if self.loader is not None:
+                    pipe.exists(key)
+            results = await pipe.execute()
+        if self.loader is None:
+            return [(item, True, values) for item, values in zip(missing, results)]
+        return [(item, bool(exists), values) for item, values, exists in zip(missing, results[::2], results[1::2])]
+
+    async def hset(self, user_id: int, mapping: dict):
+        """Write-through: пишем в Redis и сразу обновляем локальную копию"""
+        await self.redis.hset(f"{USER_KEY_PREFIX}{user_id}", mapping=mapping)
+        self.remember(user_id, mapping)
+
+    def remember(self, user_id: int, mapping: dict):
+        """Локальная копия для записи, которую вызывающий уже сделал в Redis сам"""
+        self._store(user_id, mapping, time.monotonic())
+
+    def invalidate(self, user_id: int):
+        self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    async def _listen(self):
+        from redis.exceptions import RedisError
+
+        db = self.redis.connection_pool.connection_kwargs.get("db", 0)
+        prefix = f"__keyspace@{db}__:{USER_KEY_PREFIX}"
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f"{prefix}*")
+                # Пока не подписались, изменения могли пройти мимо
+                self.clear()
+                async for message in pubsub.listen():
+                    user_id = message["channel"][len(prefix):]
+                    if user_id.isdigit():
+                        self.invalidate(int(user_id))
+            except RedisError as e:
+                logger.warning("⚠️ User cache invalidation listener error: %r, reconnecting", e)
+                self.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def start_invalidation_listener(self, configure=USER_CACHE_CONFIGURE_NOTIFICATIONS):
+        """
+        Подписка на keyspace notifications для zemo:*.
+        notify-keyspace-events (минимум "Kghx") включается в настройках сервера; CONFIG SET
+        меняет конфиг всего сервера, поэтому делаем его только с configure.
+        Без уведомлений устаревание кэша ограничено его TTL.
+        """
+        if self.listener is not None:
+            return
+        from redis.exceptions import RedisError
+
+        try:
+            current = (await self.redis.config_get("notify-keyspace-events")).get("notify-keyspace-events", "")
+            if configure:
+                flags = "".join(sorted(set(current) | set(NOTIFY_FLAGS)))
+                await self.redis.config_set("notify-keyspace-events", flags)
+            elif not set(NOTIFY_FLAGS) <= set(current.replace("A", "g$lshzxe")):
+                logger.info("ℹ️ Keyspace notifications are disabled, user cache relies on TTL=%ss", self.ttl)
+        except RedisError as e:
+            logger.warning("⚠️ Could not check keyspace notifications: %r", e)
+        self.listener = asyncio.create_task(self._listen())
+
+    async def stop_invalidation_listener(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            await asyncio.gather(self.listener, return_exceptions=True)
+            self.listener = None
+
+# Общий кэш профилей процесса
+user_cache = UserProfileCache(redis_client, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)